@@ -0,0 +1,261 @@
+"""Availability index built from the MRBS day view, one page per area instead of one form per slot"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+import config
+import mrbs
+import http_engine
+
+RESOLUTION = 1800   # MRBS slot length in seconds (30 minutes)
+MAX_AGE = 60        # Seconds before a fetched day view is considered stale
+
+
+class DayViewParser(HTMLParser):
+    """Parse the index.php?view=day grid into booked slots per room
+
+    Columns come from the header cells (data-room, or the room= link), rows from
+    the time labels (data-seconds, or the HH:MM text). Booked cells are the ones
+    linking to view_entry.php, rowspans are followed so a long booking covers
+    every slot it spans.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.resolution = None
+        self.rooms = []          # Room ids in column order
+        self.room_names = {}     # Room id -> header text
+        self.slots = []          # Slot start seconds in row order
+        self.booked = {}         # room id -> set of booked slot starts
+        self.entries = []        # {"id", "room", "start", "end", "title"}
+
+        self.in_table = False
+        self.section = None
+        self.row = None
+        self.cell = None
+        self.spans = {}          # column -> rows still covered by a rowspan above
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "table" and not self.in_table and (
+                attrs.get("id") == "day_main" or "dwm_main" in attrs.get("class", "")):
+            self.in_table = True
+            if attrs.get("data-resolution"):
+                self.resolution = int(attrs["data-resolution"])
+            return
+        if not self.in_table:
+            return
+
+        if tag in ("thead", "tbody"):
+            self.section = tag
+        elif tag == "tr":
+            self.row = {"cells": []}
+        elif tag in ("th", "td") and self.row is not None:
+            self.cell = {
+                "tag": tag,
+                "class": attrs.get("class", ""),
+                "room": attrs.get("data-room"),
+                "seconds": attrs.get("data-seconds"),
+                "rowspan": int(attrs.get("rowspan", 1) or 1),
+                "colspan": int(attrs.get("colspan", 1) or 1),
+                "entry": None,
+                "text": "",
+            }
+        elif tag == "a" and self.cell is not None:
+            href = attrs.get("href", "")
+            entry = re.search(r"view_entry\.php\?.*?\bid=(\d+)", href)
+            if entry:
+                self.cell["entry"] = int(entry.group(1))
+            room = re.search(r"\broom=(\d+)", href)
+            if room and self.cell["room"] is None and self.section == "thead":
+                self.cell["room"] = room.group(1)
+        elif tag == "div" and self.cell is not None and attrs.get("data-id"):
+            self.cell["entry"] = int(attrs["data-id"])
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell["text"] += data
+
+    def handle_endtag(self, tag):
+        if not self.in_table:
+            return
+        if tag in ("th", "td") and self.cell is not None:
+            self.row["cells"].append(self.cell)
+            self.cell = None
+        elif tag == "tr" and self.row is not None:
+            if self.section == "thead" or (self.section is None and not self.rooms):
+                self.header_row(self.row["cells"])
+            else:
+                self.body_row(self.row["cells"])
+            self.row = None
+        elif tag in ("thead", "tbody"):
+            self.section = None
+        elif tag == "table":
+            self.in_table = False
+
+    def header_row(self, cells):
+        rooms = [int(cell["room"]) for cell in cells if cell["room"]]
+        if rooms and not self.rooms:
+            self.rooms = rooms
+            self.room_names = {int(cell["room"]): " ".join(cell["text"].split())
+                               for cell in cells if cell["room"]}
+            self.booked = {room: set() for room in rooms}
+
+    def body_row(self, cells):
+        seconds = None
+        data_cells = []
+        for cell in cells:
+            if cell["seconds"] is not None:
+                seconds = int(cell["seconds"])
+            elif cell["tag"] == "th" and seconds is None:
+                match = re.search(r"(\d{1,2}):(\d{2})", cell["text"])
+                if match:
+                    seconds = int(match.group(1)) * 3600 + int(match.group(2)) * 60
+            else:
+                data_cells.append(cell)
+        if seconds is None or not self.rooms:
+            return
+        self.slots.append(seconds)
+        resolution = self.resolution or RESOLUTION
+
+        column = 0
+        for cell in data_cells:
+            # Skip columns still covered by a booking from an earlier row
+            while self.spans.get(column, 0) > 0:
+                column += 1
+            for offset in range(cell["colspan"]):
+                if column + offset >= len(self.rooms):
+                    break
+                if cell["rowspan"] > 1:
+                    self.spans[column + offset] = cell["rowspan"]
+                if self.is_booked(cell):
+                    room = self.rooms[column + offset]
+                    for step in range(cell["rowspan"]):
+                        self.booked[room].add(seconds + step * resolution)
+                    self.entries.append({
+                        "id": cell["entry"],
+                        "room": room,
+                        "start": seconds,
+                        "end": seconds + cell["rowspan"] * resolution,
+                        "title": cell["text"].strip(),
+                    })
+            column += cell["colspan"]
+
+        # This row is done, one less row left under every rowspan
+        for key in list(self.spans):
+            self.spans[key] -= 1
+            if self.spans[key] <= 0:
+                del self.spans[key]
+
+    def is_booked(self, cell):
+        if cell["entry"] is not None:
+            return True
+        classes = cell["class"].split()
+        return bool(classes) and "new" not in classes and "row_labels" not in classes
+
+
+def parse_day_view(html):
+    parser = DayViewParser()
+    parser.feed(html)
+    return {
+        "rooms": parser.rooms,
+        "room_names": parser.room_names,
+        "slots": parser.slots,
+        "booked": parser.booked,
+        "entries": parser.entries,
+        "resolution": parser.resolution or RESOLUTION,
+    }
+
+
+def fetch_day_view(session, date, area):
+    response = session.get(mrbs.day_url(date, area), timeout=http_engine.TIMEOUT)
+    response.raise_for_status()
+    return parse_day_view(response.text)
+
+
+def find_entry(grid, room, start_time, end_time, title=None):
+    """The entry covering start_time..end_time in room, optionally only one with the given title"""
+    for entry in grid["entries"]:
+        if entry["room"] == room and entry["start"] <= start_time and end_time <= entry["end"] \
+                and (title is None or entry["title"] == title):
+            return entry
+    return None
+
+
+class AvailabilityIndex:
+    """In-memory room x 30 minute slot index for every area, refreshed incrementally"""
+
+    def __init__(self, session, areas=None, max_age=MAX_AGE, workers=6):
+        self.session = session
+        self.areas = list(areas or config.area_map.values())
+        self.max_age = max_age
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.grids = {}     # (date, area) -> parsed day view + "fetched"
+        self.rooms = {}     # (date, room) -> set of booked slot starts
+
+    def stale(self, date, area):
+        grid = self.grids.get((date, area))
+        return grid is None or time.time() - grid["fetched"] > self.max_age
+
+    def refresh(self, dates, areas=None, force=False):
+        """Fetch every stale (date, area) day view in one parallel sweep"""
+        todo = [(date, area) for date in dates for area in (areas or self.areas)
+                if force or self.stale(date, area)]
+        if not todo:
+            return 0
+
+        def fetch(key):
+            date, area = key
+            try:
+                return key, fetch_day_view(self.session, date, area)
+            except Exception as e:
+                print(f"Could not fetch day view for area {area} on {date}: {e}")
+                return key, None
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(todo))) as executor:
+            for (date, area), grid in executor.map(fetch, todo):
+                if grid is not None:
+                    self.update(date, area, grid)
+        return len(todo)
+
+    def update(self, date, area, grid):
+        grid["fetched"] = time.time()
+        with self.lock:
+            self.grids[(date, area)] = grid
+            for room, booked in grid["booked"].items():
+                self.rooms[(date, room)] = set(booked)
+
+    def slots_for(self, start_time, end_time):
+        return range(start_time - start_time % RESOLUTION, end_time, RESOLUTION)
+
+    def is_free(self, room, date, start_time, end_time):
+        """True/False from the index, None when the room has not been fetched for that date"""
+        with self.lock:
+            booked = self.rooms.get((date, room))
+            if booked is None:
+                return None
+            return not any(slot in booked for slot in self.slots_for(start_time, end_time))
+
+    def free_slots(self, room, date):
+        """Free slot starts for a room, in day order"""
+        with self.lock:
+            booked = self.rooms.get((date, room), set())
+            slots = next((grid["slots"] for (grid_date, _), grid in self.grids.items()
+                          if grid_date == date and room in grid["booked"]), [])
+            return [slot for slot in slots if slot not in booked]
+
+    def area_of(self, room):
+        """Area a room was listed under on any fetched day view"""
+        with self.lock:
+            for (_, area), grid in self.grids.items():
+                if room in grid["booked"]:
+                    return area
+        return None
+
+    def mark_booked(self, room, date, start_time, end_time):
+        """Record a booking we just made so nothing tries that slot again"""
+        with self.lock:
+            booked = self.rooms.setdefault((date, room), set())
+            booked.update(self.slots_for(start_time, end_time))
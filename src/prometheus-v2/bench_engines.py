@@ -0,0 +1,115 @@
+"""End-to-end booking benchmark of every engine against the local fake_mrbs server"""
+import argparse
+import time
+from datetime import datetime, timedelta
+import mrbs
+import tracing
+from fake_mrbs import FakeMRBS
+from tracing import percentile
+
+
+def login_cookies(site):
+    """Log in through the stub CWL form and return Selenium-style cookies"""
+    import http_engine
+    session = http_engine.create_session(pool_size=1)
+    session.post(f"{site.base_url}cwl_login", timeout=http_engine.TIMEOUT)
+    cookies = http_engine.session_cookies(session)
+    session.close()
+    return cookies
+
+
+def make_jobs(site, count, date=None):
+    """count single-slot jobs spread over every room of the fake site"""
+    # A week ahead, inside the booking horizon policy.validate enforces
+    date = date or (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d")
+    rooms = [(area, room) for area, area_rooms in site.rooms.items() for room in area_rooms]
+    jobs = []
+    for i in range(count):
+        area, room = rooms[i % len(rooms)]
+        start_time = 8 * 3600 + (i // len(rooms)) * mrbs.MAX_SESSION
+        jobs.append({
+            "area": area, "room": room, "date": date,
+            "start_time": start_time, "end_time": start_time + mrbs.MAX_SESSION,
+            "room_title": "benchmark", "room_description": "", "phone_number": "", "email": "",
+        })
+    return jobs
+
+
+def bench_engine(name, site, jobs, workers, preflight=True):
+    import chronos
+    import session_cache
+    from engine import BookingEngine, Quota
+
+    cookies = login_cookies(site)
+    drivers = []
+
+    def driver_factory():
+        driver = chronos.initialize_driver()
+        session_cache.restore_session(driver, {"cookies": cookies})
+        drivers.append(driver)
+        return driver
+
+    booking_engine = BookingEngine(name, workers, quota=Quota(len(jobs)), cookies=cookies,
+                                   driver_factory=driver_factory, preflight=preflight)
+
+    # Time every slot inside the worker, so queueing in the pool is not counted
+    latencies = []
+    worker_booker = booking_engine.worker_booker
+
+    def timed_worker_booker():
+        book = worker_booker()
+
+        def timed_book(room_data, start_time, end_time, submit=True):
+            started = time.perf_counter()
+            result = book(room_data, start_time, end_time, submit)
+            latencies.append((time.perf_counter() - started) * 1000)
+            return result
+        return timed_book
+
+    booking_engine.worker_booker = timed_worker_booker
+
+    # Warm every worker up first so browser start-up is not counted as booking time
+    booking_engine.warm_up()
+
+    started = time.perf_counter()
+    results = booking_engine.run(jobs)
+    elapsed = time.perf_counter() - started
+    booking_engine.close()
+    for driver in drivers:
+        driver.quit()
+
+    statuses = {}
+    for result in results:
+        for slot in result["slots"]:
+            statuses[slot["status"]] = statuses.get(slot["status"], 0) + 1
+    return elapsed, sorted(latencies), statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engine", action="append", choices=("http", "selenium"),
+                        help="Engine to benchmark, repeat for several (default: both)")
+    parser.add_argument("--bookings", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05, help="Server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--conflict-rate", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of booking requests failing with a 503")
+    parser.add_argument("--no-preflight", action="store_true", help="Open a form for every slot, as before")
+    args = parser.parse_args()
+
+    tracing.ENABLED = False
+    print(f"{'engine':<10}{'bookings/s':>12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  outcomes")
+    for name in args.engine or ("http", "selenium"):
+        site = FakeMRBS(latency=args.latency, jitter=args.jitter, conflict_rate=args.conflict_rate,
+                        error_rate=args.error_rate).start()
+        mrbs.BASE_URL = site.base_url
+        try:
+            elapsed, latencies, statuses = bench_engine(name, site, make_jobs(site, args.bookings), args.workers,
+                                                        not args.no_preflight)
+            form_loads = site.form_loads
+        finally:
+            site.stop()
+        print(f"{name:<10}{args.bookings / elapsed:>12.2f}"
+              f"{percentile(latencies, 50):>9.0f}{percentile(latencies, 95):>9.0f}{percentile(latencies, 99):>9.0f}"
+              f"  {', '.join(f'{k} {v}' for k, v in sorted(statuses.items()))}, {form_loads} form loads")
@@ -0,0 +1,52 @@
+"""Compare page-load and per-booking time of the default and the lean browser profile
+
+Bookings are run with submit=False, so the form is loaded, filled and checked
+but nothing is actually booked.
+"""
+import argparse
+import time
+import chronos
+import config_store
+import mrbs
+from tracing import percentile
+
+
+def bench_profile(lean, room_data, runs):
+    started = time.perf_counter()
+    driver = chronos.initialize_driver(lean=lean)
+    startup = time.perf_counter() - started
+    try:
+        chronos.ensure_login(driver)
+        url = mrbs.entry_url(room_data, room_data["start_time"], room_data["end_time"])
+
+        page_loads = []
+        bookings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            driver.get(url)
+            page_loads.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            chronos.book_slot(driver, room_data, room_data["start_time"],
+                              min(room_data["end_time"], room_data["start_time"] + mrbs.MAX_SESSION),
+                              submit=False)
+            bookings.append((time.perf_counter() - started) * 1000)
+    finally:
+        driver.quit()
+    return startup, sorted(page_loads), sorted(bookings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Page loads and bookings per profile")
+    args = parser.parse_args()
+
+    room_data = config_store.load()
+
+    print(f"{'profile':<10}{'startup s':>11}{'load p50':>10}{'load p95':>10}{'book p50':>10}{'book p95':>10}")
+    for name, lean in (("default", False), ("lean", True)):
+        startup, page_loads, bookings = bench_profile(lean, room_data, args.runs)
+        print(f"{name:<10}{startup:>11.2f}"
+              f"{percentile(page_loads, 50):>10.0f}{percentile(page_loads, 95):>10.0f}"
+              f"{percentile(bookings, 50):>10.0f}{percentile(bookings, 95):>10.0f}")
+    print("(times in ms unless noted)")
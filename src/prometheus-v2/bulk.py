@@ -0,0 +1,197 @@
+"""Cancel or move every booking matching a filter in one pass over a single session
+
+    python bulk.py list 2025-03-24 2025-03-28
+    python bulk.py cancel 2025-03-24 2025-03-28 --room 23
+    python bulk.py move 2025-03-24 --to-room 24 --shift 60
+
+Bookings are found on the day view, by default the ones titled like the saved
+settings' room_title.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import http_engine
+import mrbs
+import policy
+from availability import AvailabilityIndex
+from catalog import get_catalog
+from planner import date_range
+
+WORKERS = 4   # Cancel/move requests in flight at once on the shared session
+
+
+def find_bookings(session, start_date, end_date=None, room=None, title=None, now=None):
+    """Day view entries from start_date to end_date that have not ended, optionally only in room or with title
+
+    Every entry gets its "date" and "area" added, in date, area, room and time order.
+    """
+    now = time.time() if now is None else now
+    catalog = get_catalog()
+    if room is not None:
+        if catalog.room(room) is None:
+            raise ValueError(f"Unknown room id {room}")
+        areas = [catalog.room(room).area_id]
+    else:
+        areas = sorted(set(catalog.area_map.values()))
+
+    availability = AvailabilityIndex(session, areas)
+    availability.refresh(date_range(start_date, end_date or start_date))
+
+    bookings = []
+    for (date, area), grid in sorted(availability.grids.items()):
+        for entry in grid["entries"]:
+            if room is not None and entry["room"] != room:
+                continue
+            if title is not None and entry["title"] != title:
+                continue
+            if policy.timestamp(date, entry["end"]) <= now:
+                continue
+            bookings.append(dict(entry, date=date, area=area))
+    return sorted(bookings, key=lambda entry: (entry["date"], entry["area"], entry["room"], entry["start"]))
+
+
+def move_target(entry, to_room=None, to_date=None, shift=0):
+    """(room_data, start_time, end_time) an entry moves to, shift in seconds"""
+    room = get_catalog().room(to_room) if to_room is not None else None
+    if to_room is not None and room is None:
+        raise ValueError(f"Unknown room id {to_room}")
+    room_data = {
+        "area": room.area_id if room else entry["area"],
+        "room": room.id if room else entry["room"],
+        "date": to_date or entry["date"],
+    }
+    return room_data, entry["start"] + shift, entry["end"] + shift
+
+
+def cancel(session, entry, ledger=None):
+    result = http_engine.cancel_entry(session, entry)
+    if ledger is not None and result["status"] == mrbs.RELEASED:
+        ledger.release(entry["room"], entry["date"], entry["start"], entry["end"])
+    return dict(result, entry=entry)
+
+
+def move(session, entry, to_room=None, to_date=None, shift=0, ledger=None):
+    room_data, start_time, end_time = move_target(entry, to_room, to_date, shift)
+    job = dict(room_data, start_time=start_time, end_time=end_time)
+    checked, refused = policy.validate(job, record=False)
+    if refused or checked is None:
+        message = refused[0][2] if refused else "Refused by policy"
+        result = mrbs.slot_result(room_data, start_time, end_time, mrbs.REJECTED, policy=message)
+        return dict(result, entry=entry)
+
+    result = http_engine.move_entry(session, entry, room_data, start_time, end_time)
+    if ledger is not None and result["status"] == mrbs.BOOKED:
+        # A move keeps the booking count, the ledger swaps the old slot for the new one
+        ledger.release(entry["room"], entry["date"], entry["start"], entry["end"])
+        ledger.record(result, entry["title"], "http")
+    return dict(result, entry=entry)
+
+
+def move_all(session, entries, to_room=None, to_date=None, shift=0, workers=WORKERS, ledger=None):
+    """Move every entry, results in entry order
+
+    Bookings in the same room and date move one after another, latest first when
+    shifting later and earliest first when shifting earlier, so none lands on a
+    slot another booking of the batch has not left yet. Rooms move in parallel.
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault((entry["room"], entry["date"]), []).append(entry)
+    for group in groups.values():
+        group.sort(key=lambda entry: entry["start"], reverse=shift > 0)
+
+    results = {}
+    for group_results in run(lambda group: [move(session, entry, to_room, to_date, shift, ledger)
+                                            for entry in group], list(groups.values()), workers):
+        for result in group_results:
+            results[result["entry"]["id"]] = result
+
+    # A conflict with a batch booking in another room may be gone now that everything else moved
+    for entry in entries:
+        if results[entry["id"]]["status"] == mrbs.CONFLICT:
+            results[entry["id"]] = move(session, entry, to_room, to_date, shift, ledger)
+    return [results[entry["id"]] for entry in entries]
+
+
+def run(operation, entries, workers=WORKERS):
+    """Apply operation(entry) to every entry in parallel, results in entry order"""
+    if not entries:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(entries)), thread_name_prefix="bulk") as executor:
+        return list(executor.map(operation, entries))
+
+
+def quota_freed(results, now=None):
+    """Bookings given back to the site's active booking limit"""
+    now = time.time() if now is None else now
+    return sum(1 for result in results if result["status"] == mrbs.RELEASED
+               and policy.timestamp(result["date"], result["end_time"]) > now)
+
+
+def describe(entry):
+    return (f"room {entry['room']} on {entry['date']} "
+            f"{policy.format_seconds(entry['start'])}-{policy.format_seconds(entry['end'])}")
+
+
+def print_results(results):
+    for result in results:
+        line = describe(result["entry"])
+        if result["status"] != mrbs.RELEASED:
+            line += (f" -> room {result['room']} on {result['date']} "
+                     f"{policy.format_seconds(result['start_time'])}-{policy.format_seconds(result['end_time'])}")
+        detail = result["error"] or (result["policy"] if result["status"] == mrbs.REJECTED else "") \
+            or (result["conflict"] if result["status"] == mrbs.CONFLICT else "")
+        print(f"  {line}: {result['status']}{f' ({detail})' if detail else ''}")
+
+
+if __name__ == "__main__":
+    import config_store
+    import session_cache
+    from ledger import get_ledger
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("start", help="First date, YYYY-MM-DD")
+    filters.add_argument("end", nargs="?", help="Last date, YYYY-MM-DD (default: same day)")
+    filters.add_argument("--room", type=int, help="Only bookings in this room id")
+    filters.add_argument("--title", help="Only bookings with this title (default: room_title from the saved settings)")
+    filters.add_argument("--any-title", action="store_true", help="Match bookings whatever their title")
+    filters.add_argument("--workers", type=int, default=WORKERS)
+
+    parser = argparse.ArgumentParser(description="Cancel or move bookings in bulk")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", parents=[filters], help="Show the matching bookings")
+    commands.add_parser("cancel", parents=[filters], help="Cancel the matching bookings")
+    move_parser = commands.add_parser("move", parents=[filters], help="Move the matching bookings")
+    move_parser.add_argument("--to-room", type=int, help="New room id")
+    move_parser.add_argument("--to-date", help="New date, YYYY-MM-DD")
+    move_parser.add_argument("--shift", type=int, default=0, help="Minutes to move the booking by, can be negative")
+    args = parser.parse_args()
+
+    if args.command == "move" and args.to_room is None and args.to_date is None and not args.shift:
+        parser.error("move needs --to-room, --to-date or --shift")
+
+    state = session_cache.load_session()
+    if state is None:
+        raise SystemExit("No saved session, book once or run the daemon to log in")
+    title = None if args.any_title else args.title or config_store.load()["room_title"]
+    # One keep-alive session, with a connection per worker
+    session = http_engine.create_session(state["cookies"], state.get("user_agent"), pool_size=args.workers)
+
+    try:
+        bookings = find_bookings(session, args.start, args.end, args.room, title)
+        print(f"{len(bookings)} matching booking(s)")
+        if args.command == "list":
+            for entry in bookings:
+                print(f"  {describe(entry)}: {entry['title']}")
+        elif args.command == "cancel":
+            results = run(lambda entry: cancel(session, entry, get_ledger()), bookings, args.workers)
+            print_results(results)
+            print(f"{quota_freed(results)} booking(s) of quota freed")
+        else:
+            results = move_all(session, bookings, args.to_room, args.to_date, args.shift * 60,
+                               args.workers, get_ledger())
+            print_results(results)
+            moved = sum(1 for result in results if result["status"] == mrbs.BOOKED)
+            print(f"{moved} of {len(results)} booking(s) moved")
+    finally:
+        session.close()
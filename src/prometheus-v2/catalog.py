@@ -0,0 +1,178 @@
+"""Indexed room catalog built once at startup from config.rooms_map (or a cached scrape of the site)"""
+import bisect
+import json
+import re
+import threading
+from datetime import datetime
+import config
+
+CACHE_FILE = "rooms_cache.json"
+
+# Which area each room belongs to: (area name, room name prefix), first match wins.
+# EME 1252/1254 are numbered like Tower 1 but listed under Tower 2 on the site.
+AREA_RULES = [
+    ("EME: Tower 2", "EME 1252"),
+    ("EME: Tower 2", "EME 1254"),
+    ("EME: Tower 1", "EME 1"),
+    ("EME: Tower 2", "EME 2"),
+    ("Library", "LIB"),
+    ("Commons: Floor 0", "COM 0"),
+    ("Commons: Floor 1", "COM 1"),
+    ("Commons: Floor 3", "COM 3"),
+]
+
+
+class Room:
+    __slots__ = ("id", "label", "name", "building", "floor", "capacity", "area_id")
+
+    def __init__(self, id, label, name, building, floor, capacity, area_id):
+        self.id = id
+        self.label = label          # Display string used in the GUI, e.g. "EME 1252 (10 people)"
+        self.name = name            # "EME 1252"
+        self.building = building    # "EME"
+        self.floor = floor          # Floor, or tower for EME, taken from the first digit
+        self.capacity = capacity
+        self.area_id = area_id
+
+    def __repr__(self):
+        return f"Room({self.id}, {self.name!r}, capacity={self.capacity}, area={self.area_id})"
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+def parse_room(label, room_id, area_map=None):
+    """Build a Room from a display string like "COM 110 (10)" """
+    area_map = area_map if area_map is not None else config.area_map
+    match = re.match(r"\s*([A-Za-z]+)\s*(\d+)\s*(?:\((\d+)[^)]*\))?", label)
+    if match:
+        building, number, capacity = match.group(1), match.group(2), match.group(3)
+        name = f"{building} {number}"
+        floor = int(number[0])
+        capacity = int(capacity) if capacity else 0
+    else:
+        building, name, floor, capacity = label.split(" ")[0], label.strip(), None, 0
+
+    area_id = next((area_map[area] for area, prefix in AREA_RULES
+                    if name.startswith(prefix) and area in area_map), None)
+    return Room(room_id, label, name, building, floor, capacity, area_id)
+
+
+class Catalog:
+    """Rooms with precomputed indexes by id, label, area and capacity"""
+
+    def __init__(self, rooms, area_map=None):
+        self.area_map = dict(area_map if area_map is not None else config.area_map)
+        self.area_names = {area_id: name for name, area_id in self.area_map.items()}
+        self.rooms = list(rooms)
+        self.by_id = {room.id: room for room in self.rooms}
+        self.by_label = {room.label: room for room in self.rooms}
+        self.by_area = {}
+        for room in self.rooms:
+            self.by_area.setdefault(room.area_id, []).append(room)
+        # Sorted by capacity so minimum capacity queries are a bisect
+        self.by_capacity = sorted(self.rooms, key=lambda room: room.capacity)
+        self.capacities = [room.capacity for room in self.by_capacity]
+
+    @classmethod
+    def from_rooms_map(cls, rooms_map=None, area_map=None):
+        rooms_map = rooms_map if rooms_map is not None else config.rooms_map
+        return cls([parse_room(label, room_id, area_map) for label, room_id in rooms_map.items()], area_map)
+
+    def room(self, room_id):
+        return self.by_id.get(room_id)
+
+    def room_by_label(self, label):
+        return self.by_label.get(label)
+
+    def area_name(self, area_id):
+        return self.area_names.get(area_id, "")
+
+    def alternatives(self, room_id, limit=None):
+        """Fallback rooms for room_id: same area, then same building, then the rest, closest capacity first"""
+        room = self.room(room_id)
+        if room is None:
+            return []
+
+        def rank(other):
+            place = 0 if other.area_id == room.area_id else 1 if other.building == room.building else 2
+            # Rooms at least as big as the original beat smaller ones at the same distance
+            return place, other.capacity < room.capacity, abs(other.capacity - room.capacity)
+
+        ranked = sorted((other for other in self.rooms if other.id != room.id), key=rank)
+        return ranked[:limit] if limit else ranked
+
+    def query(self, area=None, min_capacity=0):
+        """Rooms in area (id or name) with capacity >= min_capacity, in catalog order"""
+        if isinstance(area, str):
+            area = self.area_map.get(area)
+        rooms = self.rooms if area is None else self.by_area.get(area, [])
+        if not min_capacity:
+            return list(rooms)
+        start = bisect.bisect_left(self.capacities, min_capacity)
+        wanted = set(self.by_capacity[start:])
+        return [room for room in rooms if room in wanted]
+
+    def save(self, path=CACHE_FILE):
+        with open(path, "w") as f:
+            json.dump({"area_map": self.area_map, "rooms": [room.to_dict() for room in self.rooms]}, f, indent=4)
+
+    @classmethod
+    def load(cls, path=CACHE_FILE):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls([Room(**room) for room in data["rooms"]], data["area_map"])
+
+
+def scrape(session, date=None, area_map=None):
+    """Build a catalog from the room headers of every area's day view"""
+    from availability import fetch_day_view
+
+    area_map = area_map if area_map is not None else config.area_map
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    rooms = []
+    for area_name, area_id in area_map.items():
+        grid = fetch_day_view(session, date, area_id)
+        for room_id in grid["rooms"]:
+            label = grid["room_names"].get(room_id) or str(room_id)
+            room = parse_room(label, room_id, area_map)
+            room.area_id = area_id   # The site knows best which area a room is in
+            rooms.append(room)
+    return Catalog(rooms, area_map)
+
+
+catalog = None
+catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Process wide catalog, from the scrape cache if there is one, else config.rooms_map"""
+    global catalog
+    with catalog_lock:
+        if catalog is None:
+            try:
+                catalog = Catalog.load()
+            except (OSError, ValueError, KeyError, TypeError):
+                catalog = Catalog.from_rooms_map()
+        return catalog
+
+
+def refresh(session):
+    """Scrape the room list from the site and cache it on disk"""
+    global catalog
+    fresh = scrape(session)
+    fresh.save()
+    with catalog_lock:
+        catalog = fresh
+    return fresh
+
+
+if __name__ == "__main__":
+    import http_engine
+    import session_cache
+
+    # Day views are public, the cached login is only used if there is one
+    state = session_cache.load_session() or {}
+    session = http_engine.create_session(state.get("cookies", ()), state.get("user_agent"), pool_size=1)
+    for room in refresh(session).rooms:
+        print(f"{room.id:>4}  {room.label:<24}{room.capacity:>4}  {catalog.area_name(room.area_id)}")
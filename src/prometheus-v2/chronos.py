@@ -6,11 +6,16 @@ from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select 
-from selenium.common.exceptions import WebDriverException, NoSuchWindowException
-from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import WebDriverException, NoSuchWindowException, TimeoutException
 from selenium.webdriver.support import expected_conditions as EC
-import importlib
-import config
+import config_store
+import mrbs
+import session_cache
+import http_engine
+from availability import AvailabilityIndex
+import retry
+import tracing
+import waits
 from selenium.webdriver.chrome.options import Options  # Add this import at the top with other imports
 import logging
 import warnings
@@ -36,10 +41,31 @@ def read_credentials():
         print(f"Error reading credentials: {e}")
     return creds
 
-credentials = read_credentials()
+# Lean profile: stop waiting for full page loads and skip everything booking never looks at
+LEAN_PROFILE = False
+LEAN_ARGUMENTS = [
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication,InterestFeedContentSuggestions',
+    '--blink-settings=imagesEnabled=false',
+    '--mute-audio',
+    '--no-first-run',
+]
+BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.webp', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.css',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+]
 
-def initialize_driver():
-    """Initialize a headless Chrome driver"""
+def initialize_driver(profile_dir=None, lean=None):
+    """Initialize a headless Chrome driver, optionally on a persistent profile or the lean profile"""
+    lean = LEAN_PROFILE if lean is None else lean
     chrome_options = Options()
     chrome_options.add_argument('--headless=new')
     chrome_options.add_argument('--no-sandbox')
@@ -48,13 +74,28 @@ def initialize_driver():
     chrome_options.add_argument('--log-level=3')  # Set Chrome logging level
     chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])  # Disable logging
     chrome_options.add_argument('--silent')  # Run in silent mode
+
+    profile_dir = profile_dir or session_cache.PROFILE_DIR
+    if profile_dir:
+        chrome_options.add_argument(f'--user-data-dir={os.path.abspath(profile_dir)}')
+
+    if lean:
+        # driver.get returns at DOMContentLoaded, the explicit waits cover the rest
+        chrome_options.page_load_strategy = 'eager'
+        for argument in LEAN_ARGUMENTS:
+            chrome_options.add_argument(argument)
     
     driver = webdriver.Chrome(options=chrome_options)
     driver.set_window_size(600, 600)
+
+    if lean:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
     return driver
 
 def login(driver):
-    # Load credentials from credentials.txt
+    # Load credentials from credentials.txt, only when a full login is actually needed
+    credentials = read_credentials()
     username = credentials.get("USERNAME")
     password = credentials.get("PASSWORD")
     
@@ -62,133 +103,288 @@ def login(driver):
         raise Exception("Credentials not found in credentials.txt")
         
     # Base URL for booking study rooms
-    base_booking_url = "https://bookings.ok.ubc.ca/studyrooms/"
-    driver.get(base_booking_url)
-    
-    # Find the login button from the study room website and click it
-    driver.find_element(By.XPATH, "//input[@value='Log in']").click()
-    
-    # wait for user to leave base_url
-    while driver.current_url == base_booking_url:
+    base_booking_url = mrbs.BASE_URL
+    with tracing.span("login.start"):
+        driver.get(base_booking_url)
+        
+        # Find the login button from the study room website and click it
+        driver.find_element(By.XPATH, "//input[@value='Log in']").click()
+        
+        # wait for user to leave base_url
         print("Waiting for user to leave: ", driver.current_url)
-        time.sleep(1)
+        waits.until(driver, "login.leave", lambda driver: driver.current_url != base_booking_url,
+                    fixed=None, poll=1)
 
-    # Find and fill in the username and password fields
-    driver.find_element(By.ID, "username").send_keys(username)
-    driver.find_element(By.ID, "password").send_keys(password)
+    with tracing.span("login.cwl"):
+        # Find and fill in the username and password fields
+        driver.find_element(By.ID, "username").send_keys(username)
+        driver.find_element(By.ID, "password").send_keys(password)
 
-    # Click the login button on the CWL page
-    driver.find_element(By.XPATH, "//button[@type='submit']").click()
+        # Click the login button on the CWL page
+        driver.find_element(By.XPATH, "//button[@type='submit']").click()
 
-    # now wait for user to leave "authentication.ubc.ca"
-    while "authentication.ubc.ca" in driver.current_url:
+        # now wait for user to leave "authentication.ubc.ca"
         print("Waiting for user to leave: authentication.ubc.ca")
-        time.sleep(1)
+        waits.until(driver, "login.cwl", lambda driver: "authentication.ubc.ca" not in driver.current_url,
+                    fixed=None, poll=1)
 
     # Replace the while loop print statements with a single initial message
     print("Check your phone for duo authentication...")
-    while "duosecurity.com" in driver.current_url:
-        try:
-            # Automatically click the "Trust this browser" button for duo
-            duo_button = driver.find_element(By.ID, "trust-browser-button")
-            duo_button.click()
-        except WebDriverException:
-            pass
-        time.sleep(2)
+    with tracing.span("login.duo"):
+        waits.until(driver, "login.duo", duo_done, fixed=None, poll=2)
     
     print("Authentication completed")
 
-rooms_booked = 0
+def duo_done(driver):
+    """Wait condition for the Duo page, clicking "Trust this browser" whenever it shows up"""
+    if "duosecurity.com" not in driver.current_url:
+        return True
+    try:
+        # Automatically click the "Trust this browser" button for duo
+        duo_button = driver.find_element(By.ID, "trust-browser-button")
+        duo_button.click()
+    except WebDriverException:
+        pass
+    return False
+
+def ensure_login(driver):
+    """Reuse the saved session if it is still alive, otherwise run the full login"""
+    state = session_cache.load_session()
+    with tracing.span("login.probe"):
+        alive = state is not None and session_cache.probe_session(state)
+    if alive:
+        with tracing.span("login.restore"):
+            session_cache.restore_session(driver, state)
+        print("Reusing saved session, skipping login")
+        return
+
+    login(driver)
+    session_cache.save_session(driver)
+
+ENGINES = ("selenium", "http")
+
+# Fill, check and submit the booking form in one execute_async_script call instead of ~20 WebDriver round-trips
+SCRIPTED_SUBMIT = True
+CHECK_TIMEOUT = 10   # Fixed seconds to wait for the conflict/policy check titles, see waits.py
+
+# arguments: field values by id, submit, the two "all clear" titles, timeout in ms, then the callback.
+# Answers {layout: false, missing} without touching the page when an element is missing,
+# otherwise {layout: true, conflict, policy, submitted, timeout}.
+SUBMIT_SCRIPT = """
+const [fields, submit, noConflicts, noPolicyConflicts, timeout, done] = arguments;
+const byId = id => document.getElementById(id);
+const conflictCheck = byId("conflict_check"), policyCheck = byId("policy_check");
+const button = document.querySelector(".default_action");
+const missing = [...Object.keys(fields), "conflict_check", "policy_check"].filter(id => !byId(id));
+if (!button) missing.push("default_action");
+const type = byId("type");
+if (type && ![...type.options].some(option => option.value === fields.type)) missing.push("type=" + fields.type);
+if (missing.length) return done({layout: false, missing});
+
+for (const [id, value] of Object.entries(fields)) {
+  const element = byId(id);
+  element.value = element.tagName === "SELECT" ? value : element.value + value;
+  element.dispatchEvent(new Event("input", {bubbles: true}));
+  element.dispatchEvent(new Event("change", {bubbles: true}));
+}
+
+let finished = false;
+const observer = new MutationObserver(settle);
+const timer = setTimeout(() => finish(false), timeout);
+function finish(ready) {
+  if (finished) return;
+  finished = true;
+  observer.disconnect();
+  clearTimeout(timer);
+  const result = {layout: true, conflict: conflictCheck.title, policy: policyCheck.title,
+                  submitted: false, timeout: !ready};
+  if (ready && submit && result.conflict === noConflicts && result.policy === noPolicyConflicts
+      && !button.disabled) {
+    button.click();
+    result.submitted = true;
+  }
+  done(result);
+}
+function settle() {
+  if (conflictCheck.title !== "" && policyCheck.title !== "") finish(true);
+}
+observer.observe(conflictCheck, {attributes: true, attributeFilter: ["title"]});
+observer.observe(policyCheck, {attributes: true, attributeFilter: ["title"]});
+settle();
+"""
+
+
+def scripted_submit(driver, room_data, submit):
+    """Run SUBMIT_SCRIPT on the loaded form, None when the page does not look like the form it expects"""
+    fields = {
+        "name": room_data["room_title"],
+        "description": room_data["room_description"],
+        "type": "W",
+        "f_phone": room_data["phone_number"],
+        "f_email": room_data["email"],
+    }
+    timeout = waits.get_stats().timeout("selenium.script", CHECK_TIMEOUT)
+    started = time.monotonic()
+    with tracing.span("selenium.script"):
+        outcome = driver.execute_async_script(SUBMIT_SCRIPT, fields, submit, mrbs.NO_CONFLICTS,
+                                              mrbs.NO_POLICY_CONFLICTS, timeout * 1000)
+    if not outcome["layout"]:
+        tracing.write({"event": "selenium.script_fallback", "missing": outcome["missing"]})
+        return None
+    if outcome["timeout"]:
+        waits.get_stats().record("selenium.script", time.monotonic() - started)
+        raise TimeoutException(f"Conflict and policy checks did not finish within {timeout:.1f}s")
+    waits.get_stats().record("selenium.script", time.monotonic() - started)
+    return outcome
+
+
+def fill_and_check(driver, room_data):
+    """Fill the loaded form field by field and wait for the check titles, returns (conflict, policy)"""
+    # Explicit waits, with timeouts learned per wait site (see waits.py)
+    wait = lambda name, condition: waits.until(driver, name, condition, fixed=CHECK_TIMEOUT)
+
+    with tracing.span("selenium.fill"):
+        # Wait for and fill form fields, the first wait covers the page becoming ready
+        name_field = wait("selenium.form", EC.presence_of_element_located((By.ID, "name")))
+        name_field.send_keys(room_data["room_title"])
+        
+        description = wait("selenium.field", EC.presence_of_element_located((By.ID, "description")))
+        description.send_keys(room_data["room_description"])
+        
+        room_type = wait("selenium.field", EC.presence_of_element_located((By.ID, "type")))
+        Select(room_type).select_by_value("W")
+        
+        phone = wait("selenium.field", EC.presence_of_element_located((By.ID, "f_phone")))
+        phone.send_keys(room_data["phone_number"])
+        
+        email = wait("selenium.field", EC.presence_of_element_located((By.ID, "f_email")))
+        email.send_keys(room_data["email"])
+
+    with tracing.span("selenium.check"):
+        # Wait for conflict checks with timeout
+        wait("selenium.check", lambda driver: driver.find_element(By.ID, "conflict_check").get_attribute("title") != "")
+        wait("selenium.check", lambda driver: driver.find_element(By.ID, "policy_check").get_attribute("title") != "")
+        
+        conflict_title = driver.find_element(By.ID, "conflict_check").get_attribute("title")
+        policy_title = driver.find_element(By.ID, "policy_check").get_attribute("title")
+    return conflict_title, policy_title
+
+
+def book_slot(driver, room_data, start_time, end_time, submit=True, scripted=None):
+    """Book one slot through the edit_entry.php page in the browser, submit=False stops after the checks
+
+    With scripted (SCRIPTED_SUBMIT by default) the form is handled by SUBMIT_SCRIPT,
+    falling back to filling it field by field if the page layout does not match.
+    """
+    scripted = SCRIPTED_SUBMIT if scripted is None else scripted
+    submitted = False
+    try:
+        with tracing.span("selenium.get"):
+            driver.get(mrbs.entry_url(room_data, start_time, end_time))
+
+        outcome = scripted_submit(driver, room_data, submit) if scripted else None
+        if outcome is not None:
+            submitted = outcome["submitted"]
+            conflict_title, policy_title = outcome["conflict"], outcome["policy"]
+        else:
+            conflict_title, policy_title = fill_and_check(driver, room_data)
+
+        status = mrbs.check_outcome(conflict_title, policy_title)
+        if status is not None:
+            return mrbs.slot_result(room_data, start_time, end_time, status,
+                                    conflict_title, policy_title)
+        if not submit:
+            return mrbs.slot_result(room_data, start_time, end_time, mrbs.FREE,
+                                    conflict_title, policy_title)
+
+        submitted_at = None
+        if not submitted:
+            submitted = True
+            submitted_at = time.perf_counter()
+            with tracing.span("selenium.submit"):
+                submit_button = waits.until(driver, "selenium.submit",
+                                            EC.element_to_be_clickable((By.CLASS_NAME, "default_action")),
+                                            fixed=CHECK_TIMEOUT)
+                submit_button.click()
+        return mrbs.slot_result(room_data, start_time, end_time, mrbs.BOOKED,
+                                conflict_title, policy_title, submitted_at=submitted_at)
+
+    except Exception as e:
+        return mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR, error=str(e),
+                                transient=retry.is_transient(e), submitted=submitted)
+
+def print_slot_result(result):
+    """Print a per-slot result the way book_room always has"""
+    if result["status"] == mrbs.BOOKED and result["room"] != result["requested_room"]:
+        print(f"Room taken, booked room {result['room']} instead!")
+    elif result["status"] == mrbs.BOOKED:
+        print("Room booked successfully!")
+    elif result["status"] == mrbs.ERROR:
+        print(f"Error during booking attempt: {result['error']}")
+    elif result["status"] == mrbs.FREE:
+        print("Room is free, not submitted.")
+    elif result["status"] == mrbs.CANCELLED:
+        print("Booking cancelled.")
+    elif result["status"] == mrbs.REJECTED:
+        print(f"Not sent, {result['policy']}.")
+    elif result["status"] == mrbs.HELD:
+        print("Already booked by you, skipping.")
+    elif result["status"] == mrbs.TOO_EARLY:
+        print("Not open for booking yet, the site's 3 week window has not reached it.")
+    else:
+        print("Conflict detected! Skipping this session.")
+        print("Conflict:", result["conflict"])
+        print("Policy:", result["policy"])
+        if result["status"] == mrbs.LIMIT:
+            print("Booking limit reached.")
+
+def book_room(driver=None, engine="selenium", room_data=None, on_result=None, cancel=None, fallback=0):
+    """Book room_data (the saved settings by default) in 2 hour sessions, engine is "selenium" or "http"
+
+    on_result is called with every per-slot result (printed by default) and
+    setting the cancel event stops before the next slot. With fallback, a session
+    that conflicts is tried in up to that many alternative rooms. Returns the list
+    of per-slot results, or False if booking could not start.
+    """
+    from engine import BookingEngine
+    from ledger import get_ledger
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown booking engine: {engine}")
 
-def book_room(driver=None):
-    global rooms_booked
-    
     if driver is None:
-        driver = initialize_driver()
-        login(driver)
+        # Borrow a warm, logged-in driver instead of starting Chrome for every call
+        from driver_pool import get_pool
+        with get_pool().lease() as driver:
+            return book_room(driver, engine, room_data, on_result, cancel, fallback)
     
     try:
-        importlib.reload(config)
-        room_data = config.config
-        
-        start_time = room_data["start_time"]
-        end_time = room_data["end_time"]
-        
-        while start_time < end_time and rooms_booked < 3:
-            try:
-                session_end = min(start_time + 7200, end_time)
-                
-                url = (
-                    f"https://bookings.ok.ubc.ca/studyrooms/edit_entry.php?drag=1"
-                    f"&area={room_data['area']}"
-                    f"&start_seconds={start_time}"
-                    f"&end_seconds={session_end}"
-                    f"&rooms[]={room_data['room']}"
-                    f"&start_date={room_data['date']}"
-                    f"&top=0"
-                )
-                
-                print(f"\nBooking room from {convert_seconds_to_time(start_time)}"
-                        f" - {convert_seconds_to_time(session_end)}")
-                driver.get(url)
-
-                # Use explicit waits with timeouts
-                wait = WebDriverWait(driver, 10)
-                
-                # Wait for and fill form fields
-                name_field = wait.until(EC.presence_of_element_located((By.ID, "name")))
-                name_field.send_keys(room_data["room_title"])
-                
-                description = wait.until(EC.presence_of_element_located((By.ID, "description")))
-                description.send_keys(room_data["room_description"])
-                
-                room_type = wait.until(EC.presence_of_element_located((By.ID, "type")))
-                Select(room_type).select_by_value("W")
-                
-                phone = wait.until(EC.presence_of_element_located((By.ID, "f_phone")))
-                phone.send_keys(room_data["phone_number"])
-                
-                email = wait.until(EC.presence_of_element_located((By.ID, "f_email")))
-                email.send_keys(room_data["email"])
-
-                # Wait for conflict checks with timeout
-                wait.until(lambda driver: driver.find_element(By.ID, "conflict_check").get_attribute("title") != "")
-                wait.until(lambda driver: driver.find_element(By.ID, "policy_check").get_attribute("title") != "")
-                
-                conflict_title = driver.find_element(By.ID, "conflict_check").get_attribute("title")
-                policy_title = driver.find_element(By.ID, "policy_check").get_attribute("title")
-
-                if conflict_title != "No scheduling conflicts" or policy_title != "No policy conflicts":
-                    print("Conflict detected! Skipping this session.")
-                    print("Conflict:", conflict_title)
-                    print("Policy:", policy_title)
-                    
-                    if "maximum" in policy_title or "3 weeks" in policy_title:
-                        rooms_booked = 3
-                        print("Booking limit reached.")
-                        break
-                else:
-                    submit_button = wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "default_action")))
-                    submit_button.click()
-                    print("Room booked successfully!")
-                    rooms_booked += 1
-
-                start_time = session_end
-
-                if rooms_booked >= 3:
-                    rooms_booked = 0
-                    booked_url = (f"https://bookings.ok.ubc.ca/studyrooms/index.php?view=day"
-                                f"&page_date={room_data['date']}"
-                                f"&area={room_data['area']}")
-                    driver.get(booked_url)
-                    break
-                    
-            except Exception as e:
-                print(f"Error during booking attempt: {str(e)}")
-                start_time = session_end  # Move to next slot even if current fails
-                continue
-            
-        return True
+        if room_data is None:
+            room_data = config_store.load()
+
+        def print_progress(result):
+            print(f"\nBooking room from {convert_seconds_to_time(result['start_time'])}"
+                    f" - {convert_seconds_to_time(result['end_time'])}")
+            print_slot_result(result)
+
+        # The day view tells us which 2 hour sessions are already taken,
+        # fallback rooms can be in any area so then every area is read
+        day_view_session = http_engine.session_from_driver(driver, pool_size=1)
+        try:
+            availability = AvailabilityIndex(day_view_session, areas=None if fallback else [room_data["area"]])
+            with BookingEngine.from_driver(driver, engine=engine, workers=1,
+                                           on_result=on_result or print_progress,
+                                           availability=availability, cancel=cancel,
+                                           fallback=fallback, ledger=get_ledger()) as booking_engine:
+                result = booking_engine.run([room_data])[0]
+
+                # Show the day view once every booking we are allowed has been made
+                if booking_engine.quota.remaining == 0:
+                    driver.get(mrbs.day_url(room_data["date"], room_data["area"]))
+        finally:
+            day_view_session.close()
+
+        return result["slots"]
     
     except Exception as e:
         print(f"Booking error: {str(e)}")
@@ -1,3 +1,4 @@
+# Default booking settings, changes made in the GUI are saved to settings.json
 config = {
     "area": 6,
     "room": 23,
@@ -0,0 +1,77 @@
+"""Cached, atomically written store for the user's booking settings
+
+User settings live in settings.json, the static room catalog stays in config.py.
+The file is only re-read when its mtime changes and every caller gets a copy
+of the same in-memory snapshot.
+"""
+import json
+import os
+import tempfile
+import threading
+import config
+
+SETTINGS_FILE = "settings.json"
+
+lock = threading.RLock()   # Re-entrant so update can hold it across load and save
+snapshot = None
+snapshot_mtime = None
+snapshot_path = None
+
+
+def defaults():
+    """Settings used until the first save, seeded from config.config"""
+    return dict(config.config)
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load(path=SETTINGS_FILE):
+    """Return a copy of the current settings, re-reading the file only if it changed"""
+    global snapshot, snapshot_mtime, snapshot_path
+    mtime = file_mtime(path)
+    with lock:
+        if snapshot is None or mtime != snapshot_mtime or path != snapshot_path:
+            settings = defaults()
+            if mtime is not None:
+                try:
+                    with open(path, "r") as f:
+                        settings.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"Error reading {path}, using defaults: {e}")
+            snapshot, snapshot_mtime, snapshot_path = settings, mtime, path
+        return dict(snapshot)
+
+
+def save(settings, path=SETTINGS_FILE):
+    """Write the settings to a temp file and rename it over the old one"""
+    global snapshot, snapshot_mtime, snapshot_path
+    with lock:
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".settings-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(settings, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        snapshot, snapshot_mtime, snapshot_path = dict(settings), file_mtime(path), path
+
+
+def update(path=SETTINGS_FILE, **changes):
+    """Change some settings and save them"""
+    with lock:
+        settings = load(path)
+        settings.update(changes)
+        save(settings, path)
+    return settings
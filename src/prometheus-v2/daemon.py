@@ -0,0 +1,287 @@
+"""Headless booking daemon: keeps one logged-in session alive and works through the persistent job queue
+
+    python daemon.py submit 23 2025-03-24 10:00-12:00 --priority 1
+    python daemon.py list
+    python daemon.py cancel 4
+    python daemon.py run
+"""
+import argparse
+import signal
+import threading
+import time
+from datetime import datetime
+import chronos
+import config_store
+import http_engine
+import mrbs
+import policy
+import session_cache
+import sniper
+import tracing
+from catalog import get_catalog
+from engine import BookingEngine, Quota
+from jobqueue import JobQueue, DONE, FAILED, CANCELLED, EXPIRED
+from ledger import get_ledger
+from planner import parse_window
+from policy import SERVER_TZ
+from scheduler import Scheduler
+
+KEEPALIVE = 10 * 60   # Seconds between keep-alive probes, well inside the site's idle timeout
+RETRY = 30            # Seconds before re-checking a failed probe, a network blip should not cost a Duo push
+POLL = 5              # Seconds between queue checks while idle
+LEAD = 60             # Seconds before its window opens a job is claimed, so it starts right on time
+
+
+class Daemon:
+    """One authenticated HTTP session plus a booking engine, fed from a JobQueue
+
+    Claimed jobs go to a Scheduler that runs them earliest deadline first on
+    workers threads, jobs stay in the queue while the scheduler is full. Each
+    2 hour session of a job is scheduled on its own and waits for its own
+    booking window, the job is finished in the queue once all of them are.
+    """
+
+    def __init__(self, queue, engine="http", workers=1, keepalive=KEEPALIVE, poll=POLL):
+        self.queue = queue
+        self.engine = engine
+        self.workers = workers
+        self.keepalive = keepalive
+        self.poll = poll
+        self.state = None
+        self.session = None
+        self.booking_engine = None
+        self.scheduler = None
+        self.parts = {}   # Claimed job id -> its sessions still to finish and the results so far
+        self.parts_lock = threading.Lock()
+        self.last_probe = 0
+        self.clock_offset = 0.0   # Seconds the site's clock is ahead of ours
+        self.stopping = threading.Event()
+
+    def authenticate(self):
+        """Reuse the saved session if it is alive, otherwise log in once in a headless browser"""
+        state = session_cache.load_session()
+        if state is None or not session_cache.probe_session(state):
+            driver = chronos.initialize_driver()
+            try:
+                chronos.ensure_login(driver)
+                state = session_cache.load_session()
+            finally:
+                driver.quit()
+
+        if self.session is not None:
+            self.session.close()
+        if self.booking_engine is not None:
+            self.booking_engine.close()
+        self.state = state
+        self.session = http_engine.create_session(state["cookies"], state.get("user_agent"), pool_size=1)
+        # Windows open by the site's clock, a session fired by ours alone may land before it
+        try:
+            clock = sniper.estimate_clock(self.session)
+            self.clock_offset = clock["offset"]
+            print(f"Site clock offset {clock['offset'] * 1000:+.0f} ms (±{clock['error'] * 1000:.0f} ms)")
+        except Exception as e:
+            print(f"Could not measure the site's clock, going by ours: {e}")
+        self.booking_engine = BookingEngine(self.engine, self.workers, cookies=state["cookies"],
+                                            user_agent=state.get("user_agent"),
+                                            on_result=chronos.print_slot_result, ledger=get_ledger(),
+                                            clock_offset=self.clock_offset)
+        self.last_probe = time.time()
+
+        # Bookings cancelled on the website while we were away no longer count against the quota
+        try:
+            for booking in get_ledger().reconcile(self.session):
+                print(f"Booking of room {booking['room']} on {booking['date']} is gone from the day view")
+        except Exception as e:
+            print(f"Could not reconcile the ledger: {e}")
+
+    def keep_alive(self):
+        """Touch the site so the session never idles out, log in again only if it died anyway"""
+        with tracing.span("daemon.keepalive"):
+            alive = session_cache.probe_session(self.state, self.session)
+            if not alive and not self.stopping.wait(RETRY):
+                alive = session_cache.probe_session(self.state, self.session)
+
+        if alive:
+            # Push the cache expiry forward so a restarted daemon can pick the session up again
+            self.state = session_cache.save_cookies(http_engine.session_cookies(self.session),
+                                                    self.state.get("user_agent"))
+            self.last_probe = time.time()
+        elif not self.stopping.is_set():
+            print("Session expired, logging in again")
+            session_cache.clear_session()
+            self.authenticate()
+
+    def run_job(self, part):
+        """Book one session of a claimed job, runs on a scheduler worker"""
+        job = part["job"]
+        # Claimed ahead of its window, it may have been cancelled since
+        if self.queue.status(part["id"]) == CANCELLED:
+            print(f"\nJob {part['id']} was cancelled before its window opened")
+            return {"job": job, "booked": 0,
+                    "slots": [mrbs.slot_result(job, job["start_time"], job["end_time"], mrbs.CANCELLED)]}
+        print(f"\nJob {part['id']}: room {job['room']} on {job['date']} "
+              f"{chronos.convert_seconds_to_time(job['start_time'])} - {chronos.convert_seconds_to_time(job['end_time'])}")
+        return self.booking_engine.run([job])[0]
+
+    def job_done(self, item):
+        part = item["job"]
+        session = part["job"]
+        if item["status"] == EXPIRED:
+            print(f"Job {part['id']}: session at {chronos.convert_seconds_to_time(session['start_time'])} dropped, "
+                  f"its deadline passed before it could start")
+        elif item["status"] == FAILED:
+            print(f"Job {part['id']} failed: {item['error']}")
+            # Probe before the next job in case the session is what broke
+            self.last_probe = 0
+
+        with self.parts_lock:
+            parts = self.parts[part["id"]]
+            parts["left"] -= 1
+            if item["status"] == DONE:
+                parts["slots"] += item["result"]["slots"]
+            else:
+                parts[item["status"]].append(item["error"] or "Deadline passed before the session started")
+            if parts["left"]:
+                return
+            del self.parts[part["id"]]
+        self.finish(part["id"], parts)
+
+    def finish(self, job_id, parts):
+        """Write the merged result of every session of a job back to the queue"""
+        slots = sorted(parts["slots"], key=lambda slot: slot["start_time"])
+        result = {"job": parts["job"], "slots": slots,
+                  "booked": sum(1 for slot in slots if slot["status"] == mrbs.BOOKED)}
+        if parts[FAILED]:
+            self.queue.finish(job_id, FAILED, dict(result, error=parts[FAILED][0]))
+        elif parts[EXPIRED] and not slots:
+            print(f"Job {job_id} dropped, its deadline passed before it could start")
+            self.queue.finish(job_id, EXPIRED, dict(result, error=parts[EXPIRED][0]))
+        else:
+            self.queue.finish(job_id, DONE, result)
+
+    def schedule(self, claimed):
+        """Queue every session of a claimed job, each starts once its own booking window opens"""
+        job = claimed["job"]
+        sessions, refused = policy.sessions(job)
+        slots = [mrbs.slot_result(job, start, end, mrbs.REJECTED, policy=message) for start, end, message in refused]
+        for slot in slots:
+            chronos.print_slot_result(slot)
+        parts = {"job": job, "left": len(sessions), "slots": slots, FAILED: [], EXPIRED: []}
+        if not sessions:
+            self.finish(claimed["id"], parts)
+            return
+        with self.parts_lock:
+            self.parts[claimed["id"]] = parts
+        for session in sessions:
+            self.scheduler.submit({"id": claimed["id"], "job": session}, claimed["priority"],
+                                  earliest=policy.opens_at(session) - self.clock_offset,
+                                  deadline=claimed["deadline"])
+
+    def run(self):
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Requeued {recovered} job(s) left running by the last daemon")
+        self.authenticate()
+        self.scheduler = Scheduler(self.run_job, self.workers, on_done=self.job_done)
+        print("Daemon running, waiting for jobs")
+
+        while not self.stopping.is_set():
+            if time.time() - self.last_probe >= self.keepalive:
+                # Logging in again swaps the booking engine, no job may start until it is done
+                self.scheduler.pause()
+                try:
+                    self.keep_alive()
+                finally:
+                    self.scheduler.resume()
+                continue
+            # Backpressure: leave jobs in the queue, where other daemons can still claim them
+            if self.scheduler.full():
+                self.stopping.wait(self.poll)
+                continue
+            claimed = self.queue.claim(now=time.time() + self.clock_offset + LEAD)
+            if claimed is None:
+                self.stopping.wait(self.poll)
+                continue
+            if not self.scheduler.busy():
+                # Bookings that have ended since the last job no longer count
+                self.booking_engine.quota = Quota(used=get_ledger().active_count())
+            self.schedule(claimed)
+
+        # A job with sessions left goes back whole, the ledger skips the sessions already booked
+        for job_id in {item["job"]["id"] for item in self.scheduler.close()}:
+            self.queue.requeue(job_id)
+        self.scheduler.report()
+        self.booking_engine.close()
+        self.session.close()
+        print("Daemon stopped")
+
+    def stop(self, *args):
+        self.stopping.set()
+
+
+def make_job(room_id, date, window, title=None):
+    """Booking job for a room id, with the booking details from the saved settings"""
+    room = get_catalog().room(room_id)
+    if room is None:
+        raise ValueError(f"Unknown room id {room_id}")
+    start_time, end_time = parse_window(window)
+    job = config_store.load()
+    job.update({"area": room.area_id, "room": room.id, "date": date,
+                "start_time": start_time, "end_time": end_time})
+    if title:
+        job["room_title"] = title
+    return job
+
+
+def print_jobs(queue):
+    print(f"{'id':>4}  {'status':<10}{'prio':>5}  {'room':<10}{'date':<12}{'time':<14}booked")
+    for item in queue.jobs():
+        job = item["job"]
+        room = get_catalog().room(job["room"])
+        times = (f"{chronos.convert_seconds_to_time(job['start_time'])[:5]}"
+                 f"-{chronos.convert_seconds_to_time(job['end_time'])[:5]}")
+        booked = item["result"].get("booked", "") if item["result"] else ""
+        print(f"{item['id']:>4}  {item['status']:<10}{item['priority']:>5}  "
+              f"{room.name if room else job['room']:<10}{job['date']:<12}{times:<14}{booked}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless booking daemon and its job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the daemon until interrupted")
+    run_parser.add_argument("--engine", choices=chronos.ENGINES, default="http")
+    run_parser.add_argument("--workers", type=int, default=1, help="Jobs booked at the same time")
+    run_parser.add_argument("--keepalive", type=int, default=KEEPALIVE, help="Seconds between keep-alive probes")
+
+    submit_parser = commands.add_parser("submit", help="Queue a booking")
+    submit_parser.add_argument("room", type=int, help="Room id")
+    submit_parser.add_argument("date", help="YYYY-MM-DD")
+    submit_parser.add_argument("window", help="HH:MM-HH:MM")
+    submit_parser.add_argument("--title", help="Booking title (default: from the saved settings)")
+    submit_parser.add_argument("--priority", type=int, default=0, help="Higher runs first")
+    submit_parser.add_argument("--deadline", help="YYYY-MM-DD HH:MM to be done by (default: the booking's start)")
+
+    commands.add_parser("list", help="Show queued and finished jobs")
+
+    cancel_parser = commands.add_parser("cancel", help="Drop a job that has not started")
+    cancel_parser.add_argument("id", type=int)
+
+    args = parser.parse_args()
+    queue = JobQueue()
+
+    if args.command == "run":
+        daemon = Daemon(queue, args.engine, args.workers, args.keepalive)
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        daemon.run()
+    elif args.command == "submit":
+        deadline = None
+        if args.deadline:
+            deadline = datetime.strptime(args.deadline, "%Y-%m-%d %H:%M").replace(tzinfo=SERVER_TZ).timestamp()
+        job_id = queue.submit(make_job(args.room, args.date, args.window, args.title), args.priority, deadline)
+        print(f"Queued job {job_id}")
+    elif args.command == "list":
+        print_jobs(queue)
+    elif args.command == "cancel":
+        print("Cancelled" if queue.cancel(args.id) else "Job has already started or finished")
@@ -0,0 +1,213 @@
+"""Pool of warm, logged-in Chrome drivers with health checks and recycling"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import chronos
+import session_cache
+
+POOL_SIZE = 1        # Drivers kept warm
+MAX_USES = 20        # Bookings before a driver is recycled
+MAX_AGE = 2 * 3600   # Seconds before a driver is recycled
+
+
+class DriverPool:
+    """Keeps size logged-in drivers ready and replaces dead or worn out ones in the background"""
+
+    def __init__(self, size=POOL_SIZE, max_uses=MAX_USES, max_age=MAX_AGE, factory=None):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.factory = factory or self.new_driver
+
+        self.idle = queue.Queue()
+        self.info = {}        # id(driver) -> {"created": ..., "uses": ...}
+        self.lock = threading.Lock()
+        # Notified whenever a driver goes idle, a build fails or the pool closes
+        self.changed = threading.Condition(self.lock)
+        self.pending = 0
+        self.closed = False
+        self.created = 0
+        # Set once the first driver is logged in and waiting
+        self.ready = threading.Event()
+        # Set once the first build finished either way, error holds why the last one failed
+        self.settled = threading.Event()
+        self.error = None
+        # One at a time, so only the first driver does a full login and the rest reuse its session
+        self.builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="driver-pool")
+
+    def new_driver(self):
+        """Start a driver and log it in, reusing the saved session when possible"""
+        profile_dir = session_cache.PROFILE_DIR
+        if profile_dir:
+            # Chrome cannot share one profile between running instances
+            profile_dir = f"{profile_dir}-{self.created}"
+        driver = chronos.initialize_driver(profile_dir)
+        chronos.ensure_login(driver)
+        return driver
+
+    def start(self):
+        """Warm the pool up to size in the background"""
+        with self.lock:
+            missing = self.size - len(self.info) - self.pending
+        for _ in range(missing):
+            self.replace()
+        return self
+
+    def replace(self):
+        """Build one replacement driver in the background"""
+        with self.lock:
+            if self.closed:
+                return
+            self.pending += 1
+        self.builder.submit(self.build)
+
+    def build(self):
+        try:
+            driver = self.factory()
+        except Exception as e:
+            print(f"Driver pool could not start a driver: {e}")
+            with self.lock:
+                self.pending -= 1
+                self.error = e
+                self.changed.notify_all()
+            self.settled.set()
+            return
+
+        with self.lock:
+            self.pending -= 1
+            self.created += 1
+            if self.closed:
+                driver.quit()
+                return
+            self.error = None
+            self.info[id(driver)] = {"created": time.time(), "uses": 0}
+            self.idle.put(driver)
+            self.changed.notify_all()
+        self.ready.set()
+        self.settled.set()
+
+    def wait_ready(self):
+        """Block until the first driver is logged in, raises if building it failed"""
+        self.settled.wait()
+        if not self.ready.is_set():
+            raise Exception(f"Could not start the browser: {self.error}")
+
+    def is_alive(self, driver):
+        """Liveness probe, a single cheap WebDriver round-trip"""
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def is_worn_out(self, driver):
+        info = self.info.get(id(driver))
+        return (info is None
+                or info["uses"] >= self.max_uses
+                or time.time() - info["created"] >= self.max_age)
+
+    def retire(self, driver):
+        """Quit a driver and start building its replacement"""
+        with self.lock:
+            self.info.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        self.replace()
+
+    def acquire(self, timeout=None):
+        """Hand out a healthy driver, waiting for one to be built if needed
+
+        Raises when building the driver it waits for fails, instead of waiting forever.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self.lock:
+                if self.closed:
+                    raise Exception("Driver pool is closed")
+                starved = self.idle.empty() and len(self.info) + self.pending < self.size
+            if starved:
+                self.replace()
+
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            with self.lock:
+                # Nothing idle, building or leased out once a build failed: no driver is coming
+                if not self.changed.wait_for(lambda: self.closed or not self.idle.empty()
+                                             or (self.error is not None and not self.pending and not self.info),
+                                             remaining):
+                    raise Exception("Timed out waiting for a browser")
+                if self.closed:
+                    raise Exception("Driver pool is closed")
+                if self.idle.empty():
+                    raise Exception(f"Could not start the browser: {self.error}")
+                driver = self.idle.get_nowait()
+
+            if self.is_worn_out(driver) or not self.is_alive(driver):
+                self.retire(driver)
+                continue
+            return driver
+
+    def release(self, driver, broken=False):
+        """Return a driver after a booking, recycling it when it has done enough work"""
+        with self.lock:
+            info = self.info.get(id(driver))
+            if info is not None:
+                info["uses"] += 1
+        if broken or self.closed or self.is_worn_out(driver):
+            self.retire(driver)
+        else:
+            with self.lock:
+                self.idle.put(driver)
+                self.changed.notify_all()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        driver = self.acquire(timeout)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = not self.is_alive(driver)
+            raise
+        finally:
+            self.release(driver, broken)
+
+    def close(self):
+        """Quit every idle driver, leased ones are quit when they come back"""
+        with self.lock:
+            self.closed = True
+            self.changed.notify_all()
+        self.builder.shutdown(wait=True)
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process wide pool shared by the GUI and the chronos entry points"""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = DriverPool().start()
+        return pool
+
+
+def close_pool():
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
@@ -0,0 +1,432 @@
+"""Reentrant booking engine that runs several room/date/slot jobs at once"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import mrbs
+import http_engine
+import chronos
+import driver_pool
+import tracing
+import policy
+import retry
+from availability import fetch_day_view, find_entry
+from catalog import get_catalog
+
+FALLBACK_ROOMS = 4     # Alternative rooms tried after a conflict when fallback is on
+
+
+class Quota:
+    """Lock protected counter for the site's active booking limit
+
+    Workers reserve a booking before they submit. While other reservations are
+    still in flight a worker waits for them instead of giving up, so a slot is
+    only reported as over the limit once the limit is really used up.
+    """
+
+    def __init__(self, limit=mrbs.MAX_BOOKINGS, used=0):
+        self.limit = limit
+        self.used = used
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Reserve one booking, False once the limit is reached"""
+        with self.condition:
+            while self.used + self.pending >= self.limit and self.used < self.limit:
+                self.condition.wait()
+            if self.used >= self.limit:
+                return False
+            self.pending += 1
+            return True
+
+    def confirm(self):
+        """The reserved booking went through"""
+        with self.condition:
+            self.pending -= 1
+            self.used = min(self.limit, self.used + 1)
+            self.condition.notify_all()
+
+    def release(self):
+        """Give back a reservation that did not end in a booking"""
+        with self.condition:
+            self.pending -= 1
+            self.condition.notify_all()
+
+    def exhaust(self, reserved=True):
+        """The server says we are at the limit, stop every other worker too
+
+        reserved is False when the limit was known before a booking was reserved.
+        """
+        with self.condition:
+            if reserved:
+                self.pending -= 1
+            self.used = self.limit
+            self.condition.notify_all()
+
+    @property
+    def remaining(self):
+        with self.condition:
+            return self.limit - self.used
+
+
+class BookingEngine:
+    """Runs booking jobs on a thread pool, each worker with its own session or driver
+
+    A job is a dict shaped like the booking settings. Every job is split into 2 hour
+    sessions which are booked one after another, while separate jobs run in parallel.
+    """
+
+    def __init__(self, engine="http", workers=3, quota=None,
+                 driver_factory=None, cookies=(), user_agent=None, on_result=None,
+                 availability=None, cancel=None, fallback=0, preflight=True, ledger=None, clock_offset=0.0):
+        if engine not in chronos.ENGINES:
+            raise ValueError(f"Unknown booking engine: {engine}")
+        self.engine = engine
+        self.workers = workers
+        # Optional ledger.Ledger, every result is recorded in it and slots it shows as ours are skipped
+        self.ledger = ledger
+        self.quota = quota or Quota(used=ledger.active_count() if ledger is not None else 0)
+        # Seconds the site's clock is ahead of ours (sniper.estimate_clock), the booking window follows the site's
+        self.clock_offset = clock_offset
+        self.driver_factory = driver_factory or self.new_driver
+        self.cookies = list(cookies)
+        self.user_agent = user_agent
+        self.on_result = on_result
+        # Optional availability.AvailabilityIndex, slots it knows are taken are never opened
+        self.availability = availability
+        # Set this event to stop every job before its next slot
+        self.cancelled = cancel or threading.Event()
+        # How many alternative rooms to try when a slot conflicts, 0 to skip the slot as before
+        self.fallback = fallback
+        # Check every session of a batch over plain HTTP up front, only the ones that pass open a form
+        self.preflight = preflight
+        self.checker = None
+        self.checked = {}   # (room, date, start, end) -> pre-flight result
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.drivers = []
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="booking")
+
+    @classmethod
+    def from_driver(cls, driver, engine="http", workers=1, **kwargs):
+        """Build an engine around an already logged-in driver"""
+        cookies = driver.get_cookies()
+        user_agent = driver.execute_script("return navigator.userAgent")
+        handed_out = []
+        booking_engine = cls(engine, workers, cookies=cookies, user_agent=user_agent, **kwargs)
+
+        def driver_factory():
+            # The first selenium worker reuses the caller's driver, the rest get their own
+            if not handed_out:
+                handed_out.append(driver)
+                return driver
+            return booking_engine.new_driver()
+
+        booking_engine.driver_factory = driver_factory
+        return booking_engine
+
+    def new_driver(self):
+        """Borrow a logged-in driver from the shared pool for this engine's lifetime"""
+        driver = driver_pool.get_pool().acquire()
+        with self.lock:
+            self.drivers.append(driver)
+        return driver
+
+    def worker_booker(self):
+        """Return this worker thread's slot booking function"""
+        book = getattr(self.local, "book", None)
+        if book is not None:
+            return book
+
+        if self.engine == "http":
+            session = http_engine.create_session(self.cookies, self.user_agent)
+            with self.lock:
+                self.sessions.append(session)
+            book = lambda room_data, start, end, submit=True: \
+                http_engine.book_slot(session, room_data, start, end, submit)
+        else:
+            driver = tracing.instrument(self.driver_factory())
+            book = lambda room_data, start, end, submit=True: \
+                chronos.book_slot(driver, room_data, start, end, submit)
+        self.local.book = book
+        return book
+
+    def warm_up(self):
+        """Set up every worker's session or driver now, so the first jobs do not pay for it"""
+        # The barrier keeps each worker busy until all of them ran, so every thread gets one
+        barrier = threading.Barrier(self.workers)
+
+        def warm(_):
+            try:
+                self.worker_booker()
+            finally:
+                barrier.wait()
+        list(self.executor.map(warm, range(self.workers)))
+
+    def slot_checker(self):
+        """The shared pre-flight checker, its own pooled session with this engine's cookies"""
+        with self.lock:
+            if self.checker is None:
+                session = http_engine.create_session(self.cookies, self.user_agent,
+                                                     http_engine.PREFLIGHT_WORKERS)
+                self.checker = http_engine.SlotChecker(session)
+            return self.checker
+
+    def with_area(self, job):
+        if job.get("area") is None:
+            # Jobs may name just the room, the catalog knows its area
+            room = get_catalog().room(job["room"])
+            job = dict(job, area=room.area_id if room else None)
+        return job
+
+    def run_preflight(self, jobs):
+        """Check every session of the jobs in parallel, returns how many failed the check"""
+        sessions = []
+        for job in jobs:
+            valid_job, _ = policy.validate(job, now=time.time() + self.clock_offset, record=False)
+            if valid_job is None:
+                continue
+            for start_time in range(valid_job["start_time"], valid_job["end_time"], mrbs.MAX_SESSION):
+                end_time = min(start_time + mrbs.MAX_SESSION, valid_job["end_time"])
+                if self.availability is not None and self.availability.is_free(
+                        job["room"], job["date"], start_time, end_time) is False:
+                    continue
+                if self.ledger is not None and self.ledger.holds(job["room"], job["date"], start_time, end_time):
+                    continue
+                sessions.append((valid_job, start_time, end_time))
+        if not sessions:
+            return 0
+
+        with tracing.span("preflight", sessions=len(sessions)):
+            results = self.slot_checker().check_all(sessions)
+        with self.lock:
+            for result in results:
+                self.checked[(result["room"], result["date"], result["start_time"], result["end_time"])] = result
+        return sum(1 for result in results if result["status"] in (mrbs.CONFLICT, mrbs.LIMIT))
+
+    def known_outcome(self, job, start_time, end_time):
+        """A conflict or limit already known for a session, from the day view or the pre-flight"""
+        if self.availability is not None and self.availability.is_free(
+                job["room"], job["date"], start_time, end_time) is False:
+            return mrbs.slot_result(job, start_time, end_time, mrbs.CONFLICT,
+                                    conflict="Already booked on the day view")
+        with self.lock:
+            checked = self.checked.pop((job["room"], job["date"], start_time, end_time), None)
+        if checked is not None and checked["status"] in (mrbs.CONFLICT, mrbs.LIMIT):
+            return mrbs.slot_result(job, start_time, end_time, checked["status"],
+                                    checked["conflict"], checked["policy"])
+        return None
+
+    def run_job(self, job):
+        """Book one job in 2 hour sessions, returns the job result"""
+        job = self.with_area(job)
+        slots = []
+
+        # Refuse or trim what the site would reject anyway, before a session or driver is even set up
+        valid_job, refused = policy.validate(job, now=time.time() + self.clock_offset)
+        for start, end, message in refused:
+            result = mrbs.slot_result(job, start, end, mrbs.REJECTED, policy=message)
+            slots.append(result)
+            if self.on_result:
+                self.on_result(result)
+        if valid_job is None:
+            return {"job": job, "slots": slots, "booked": 0}
+        job = valid_job
+
+        try:
+            book = self.worker_booker()
+        except Exception as e:
+            slots.append(mrbs.slot_result(job, job["start_time"], job["end_time"], mrbs.ERROR, error=str(e)))
+            return {"job": job, "slots": slots, "booked": 0}
+        start_time = job["start_time"]
+        end_time = job["end_time"]
+        retry_deadline = time.monotonic() + retry.BUDGET
+
+        while start_time < end_time:
+            session_end = min(start_time + mrbs.MAX_SESSION, end_time)
+
+            if self.cancelled.is_set():
+                result = mrbs.slot_result(job, start_time, end_time, mrbs.CANCELLED)
+                slots.append(result)
+                if self.on_result:
+                    self.on_result(result)
+                break
+
+            # Already ours, or known to be taken or over the limit: no need to open the form
+            held = self.ledger is not None and self.ledger.holds(job["room"], job["date"], start_time, session_end)
+            known = None if held else self.known_outcome(job, start_time, session_end)
+            latency_ms = None
+            if held:
+                result = mrbs.slot_result(job, start_time, session_end, mrbs.HELD)
+            elif known is not None and (known["status"] == mrbs.LIMIT or not self.fallback):
+                result = known
+                if known["status"] == mrbs.LIMIT:
+                    # The pre-flight already hit the limit, no other worker should load a form either
+                    self.quota.exhaust(reserved=False)
+            elif not self.quota.acquire():
+                policy.count("quota")
+                result = mrbs.slot_result(job, start_time, session_end, mrbs.LIMIT,
+                                          error="Booking limit reached")
+            else:
+                started = time.perf_counter()
+                with tracing.booking(engine=self.engine, room=job["room"], date=job["date"],
+                                     start_time=start_time, end_time=session_end):
+                    if known is not None:
+                        result = known
+                    else:
+                        result = self.book_with_retry(book, job, start_time, session_end, retry_deadline)
+                    if result["status"] == mrbs.CONFLICT and self.fallback:
+                        result = self.book_fallback(book, job, start_time, session_end) or result
+                latency_ms = (time.perf_counter() - started) * 1000
+                if result["status"] == mrbs.BOOKED:
+                    self.quota.confirm()
+                    if self.availability is not None:
+                        self.availability.mark_booked(result["room"], job["date"], start_time, session_end)
+                elif result["status"] == mrbs.LIMIT:
+                    self.quota.exhaust()
+                else:
+                    self.quota.release()
+
+            if self.ledger is not None and not held:
+                self.ledger.record(result, job["room_title"], self.engine, latency_ms)
+            slots.append(result)
+            if self.on_result:
+                self.on_result(result)
+            if result["status"] == mrbs.LIMIT:
+                break
+            start_time = session_end
+
+        return {
+            "job": job,
+            "slots": slots,
+            "booked": sum(1 for slot in slots if slot["status"] == mrbs.BOOKED),
+        }
+
+    def book_with_retry(self, book, job, start_time, end_time, deadline):
+        """Book one session, retrying transient failures with backoff until the job's budget is spent
+
+        A failure after the submit was sent may still have booked the room, so the
+        day view is checked first and a booking that landed is reported as booked
+        instead of being tried again. A session the site says is not open yet is
+        tried again every EARLY_DELAY, its window opens any moment.
+        """
+        attempt = 1
+        while True:
+            result = book(job, start_time, end_time)
+            if result["status"] == mrbs.TOO_EARLY and time.monotonic() + retry.EARLY_DELAY <= deadline:
+                if self.cancelled.wait(retry.EARLY_DELAY):
+                    return result
+                continue
+            if result["status"] != mrbs.ERROR or not result["transient"]:
+                return result
+            if result["submitted"] and self.landed(job, start_time, end_time):
+                return mrbs.slot_result(job, start_time, end_time, mrbs.BOOKED,
+                                        result["conflict"], result["policy"])
+
+            delay = retry.backoff(attempt)
+            if attempt >= retry.MAX_ATTEMPTS or time.monotonic() + delay > deadline:
+                return result
+            tracing.write({"event": "retry", "attempt": attempt, "error": result["error"],
+                           "booking": getattr(tracing.local, "booking", None)})
+            if self.cancelled.wait(delay):
+                return result
+            attempt += 1
+
+    def landed(self, job, start_time, end_time):
+        """Whether a booking with this job's title shows on the day view for the session"""
+        session = getattr(self.local, "verify_session", None)
+        if session is None:
+            session = self.local.verify_session = http_engine.create_session(self.cookies, self.user_agent, 1)
+            with self.lock:
+                self.sessions.append(session)
+        try:
+            with tracing.span("retry.verify"):
+                grid = fetch_day_view(session, job["date"], job["area"])
+        except Exception:
+            return False
+        if self.availability is not None:
+            self.availability.update(job["date"], job["area"], grid)
+        return find_entry(grid, job["room"], start_time, end_time, job["room_title"]) is not None
+
+    def fallback_rooms(self, job, start_time, end_time):
+        """Ranked alternatives to job's room that are open and not known to be taken"""
+        rooms = []
+        for room in get_catalog().alternatives(job["room"]):
+            if len(rooms) == self.fallback:
+                break
+            if not policy.is_open(room.area_id, start_time, end_time):
+                continue
+            if self.availability is not None and self.availability.is_free(
+                    room.id, job["date"], start_time, end_time) is False:
+                continue
+            rooms.append(room)
+        return rooms
+
+    def book_fallback(self, book, job, start_time, end_time):
+        """Book the same time in the first alternative room that is free, None if none is
+
+        Alternatives are checked in parallel over HTTP without loading their forms.
+        The first one to come back free is booked from this worker, and once a booking
+        goes through the checks still queued are cancelled.
+        """
+        candidates = [dict(job, room=room.id, area=room.area_id, requested_room=job["room"])
+                      for room in self.fallback_rooms(job, start_time, end_time)]
+        if not candidates:
+            return None
+
+        checker = self.slot_checker()
+        futures = [checker.submit(candidate, start_time, end_time) for candidate in candidates]
+        try:
+            for future in as_completed(futures):
+                checked = future.result()
+                if checked["status"] == mrbs.LIMIT:
+                    return checked
+                if checked["status"] != mrbs.FREE or self.cancelled.is_set():
+                    continue
+                candidate = next(c for c in candidates if c["room"] == checked["room"])
+                result = book(candidate, start_time, end_time)
+                if result["status"] in (mrbs.BOOKED, mrbs.LIMIT):
+                    return result
+        finally:
+            for future in futures:
+                future.cancel()
+        return None
+
+    def submit(self, jobs):
+        """Queue a batch of jobs, returns one future per job"""
+        if self.availability is not None:
+            # Bring the index up to date for these dates, only stale day views are fetched
+            self.availability.refresh(sorted({job["date"] for job in jobs}))
+        jobs = [self.with_area(job) for job in jobs]
+        if self.preflight:
+            self.run_preflight(jobs)
+        return [self.executor.submit(self.run_job, job) for job in jobs]
+
+    def run(self, jobs):
+        """Run a batch of jobs and wait for the per-job results, in job order"""
+        return [future.result() for future in self.submit(jobs)]
+
+    def cancel(self):
+        """Stop every running job before its next slot, queued jobs stop straight away"""
+        self.cancelled.set()
+
+    def close(self):
+        """Shut the pool down, close its sessions and return borrowed drivers"""
+        self.executor.shutdown(wait=True)
+        if self.checker is not None:
+            self.checker.close()
+            self.checker = None
+        for session in self.sessions:
+            session.close()
+        for driver in self.drivers:
+            driver_pool.get_pool().release(driver)
+        self.sessions = []
+        self.drivers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,393 @@
+"""Local stand-in for the MRBS study room site, with configurable latency and conflicts
+
+Serves just what chronos uses: the studyrooms page with its Log in button, a
+stub CWL login, edit_entry.php with the booking form and its asynchronous
+conflict/policy check, edit_entry_handler.php, the day view, and editing
+(edit_entry.php?id=) and deleting (view_entry.php, del_entry.php) a booking.
+
+    python fake_mrbs.py --port 8000 --latency 0.05 --conflict-rate 0.2
+    PROMETHEUS_BASE_URL=http://127.0.0.1:8000/studyrooms/ python prometheus.py
+"""
+import argparse
+import html
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from catalog import Catalog
+from policy import timestamp
+
+PREFIX = "/studyrooms/"
+SESSION_COOKIE = "MRBS_SESSID"
+RESOLUTION = 1800
+DAY_START = 6 * 3600
+DAY_END = 24 * 3600 + 1800
+
+
+def default_rooms():
+    """Area id -> room ids, from the room catalog"""
+    rooms_catalog = Catalog.from_rooms_map()
+    return {area_id: [room.id for room in rooms_catalog.query(area=area_id)]
+            for area_id in rooms_catalog.area_map.values()}
+
+
+class FakeMRBS:
+    """In-memory booking state plus the HTTP server around it"""
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, conflict_rate=0.0,
+                 max_bookings=None, rooms=None, seed=0, error_rate=0.0, horizon=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.conflict_rate = conflict_rate
+        self.max_bookings = max_bookings
+        # Share of booking requests answered with a 503, half of the failed submits still book
+        self.error_rate = error_rate
+        # Seconds ahead of its own clock a booking may start (the real site's 3 weeks), None for no limit
+        self.horizon = horizon
+        self.rooms = rooms or default_rooms()
+        self.labels = {room.id: room.label for room in Catalog.from_rooms_map().rooms}
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.entries = []
+        self.next_id = 1
+        self.sessions = set()
+        self.requests = 0
+        self.form_loads = 0
+        self.day_views = 0   # Day view answers with a body, 304s not counted
+
+        handler = type("Handler", (FakeHandler,), {"site": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{PREFIX}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def injected_error(self):
+        return self.error_rate and random.random() < self.error_rate
+
+    def injected_conflict(self, room, date, start):
+        """Deterministic per slot, so the check and the commit agree"""
+        if not self.conflict_rate:
+            return False
+        value = zlib.crc32(f"{self.seed}:{room}:{date}:{start}".encode()) / 0xFFFFFFFF
+        return value < self.conflict_rate
+
+    def check(self, room, date, start, end, exclude=None):
+        """Return (conflicts, policy errors) for a requested booking, exclude is the id of an entry being edited"""
+        conflicts = []
+        with self.lock:
+            others = [entry for entry in self.entries if entry["id"] != exclude]
+            for entry in others:
+                if entry["room"] == room and entry["date"] == date \
+                        and entry["start"] < end and start < entry["end"]:
+                    conflicts.append(f"{entry['name']} ({date})")
+            booked = len(others)
+        if not conflicts and self.injected_conflict(room, date, start):
+            conflicts.append(f"Booked by someone else ({date})")
+
+        errors = []
+        if end - start > 7200:
+            errors.append("The maximum duration of a booking is 2 hours")
+        if self.max_bookings is not None and booked >= self.max_bookings:
+            errors.append(f"You have reached the maximum number of {self.max_bookings} bookings")
+        if self.horizon is not None and timestamp(date, start) - time.time() > self.horizon:
+            errors.append("You cannot book more than 3 weeks in advance")
+        return conflicts, errors
+
+    def add_entry(self, room, date, start, end, name):
+        with self.lock:
+            entry = {"id": self.next_id, "room": room, "date": date,
+                     "start": start, "end": end, "name": name}
+            self.next_id += 1
+            self.entries.append(entry)
+            return entry
+
+    def entry(self, entry_id):
+        with self.lock:
+            return next((dict(entry) for entry in self.entries if entry["id"] == entry_id), None)
+
+    def update_entry(self, entry_id, room, date, start, end):
+        with self.lock:
+            for entry in self.entries:
+                if entry["id"] == entry_id:
+                    entry.update(room=room, date=date, start=start, end=end)
+
+    def remove_entry(self, entry_id):
+        """Someone cancels their booking"""
+        with self.lock:
+            self.entries = [entry for entry in self.entries if entry["id"] != entry_id]
+
+    def area_of(self, room):
+        return next((area for area, rooms in self.rooms.items() if room in rooms), 0)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    site = None
+
+    def log_message(self, *args):
+        pass
+
+    # Plumbing
+
+    def logged_in(self):
+        cookies = self.headers.get("Cookie", "")
+        return any(part.strip() == f"{SESSION_COOKIE}={session}"
+                   for part in cookies.split(";") for session in list(self.site.sessions))
+
+    def reply(self, body, status=200, content_type="text/html", headers=()):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def redirect(self, location, headers=()):
+        self.send_response(303)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def form_data(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return parse_qs(self.rfile.read(length).decode(), keep_blank_values=True)
+
+    def route(self, method):
+        self.site.delay()
+        with self.site.lock:
+            self.site.requests += 1
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        page = url.path[len(PREFIX):] if url.path.startswith(PREFIX) else None
+
+        if page in ("", "index.php") and query.get("view") == ["day"]:
+            return self.day_view(query)
+        if page in ("", "index.php"):
+            return self.home()
+        if page == "login.php":
+            return self.login_page()
+        if page == "cwl_login" and method == "POST":
+            return self.cwl_login()
+        if page == "edit_entry.php":
+            return self.edit_entry(query)
+        if page == "view_entry.php":
+            return self.view_entry(query)
+        if page == "del_entry.php" and method == "POST":
+            return self.del_entry(self.form_data())
+        if page == "edit_entry_handler.php" and method == "POST":
+            return self.edit_entry_handler(self.form_data())
+        self.reply("Not found", 404)
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_HEAD(self):
+        self.route("HEAD")
+
+    def do_POST(self):
+        self.route("POST")
+
+    # Pages
+
+    def home(self):
+        if self.logged_in():
+            body = '<form><input type="submit" value="Log off"></form>'
+        else:
+            body = f'<form action="{PREFIX}login.php"><input type="submit" value="Log in"></form>'
+        self.reply(f"<html><body><h1>Study rooms</h1>{body}</body></html>")
+
+    def login_page(self):
+        self.reply(f"""<html><body><form method="post" action="{PREFIX}cwl_login">
+<input id="username" name="username"><input id="password" name="password" type="password">
+<button type="submit">Login</button></form></body></html>""")
+
+    def cwl_login(self):
+        session = f"fake{random.getrandbits(64):016x}"
+        self.site.sessions.add(session)
+        self.redirect(PREFIX, [("Set-Cookie", f"{SESSION_COOKIE}={session}; Path=/")])
+
+    def edit_entry(self, query):
+        if not self.logged_in():
+            return self.home()
+        with self.site.lock:
+            self.site.form_loads += 1
+        get = lambda key, default="": query.get(key, [default])[0]
+        entry_id, name = get("id"), ""
+        if entry_id:
+            # Editing a booking, the form comes prefilled with it
+            entry = self.site.entry(int(entry_id))
+            if entry is None:
+                return self.reply("No such entry", 404)
+            values = {"area": self.site.area_of(entry["room"]), "start_date": entry["date"],
+                      "start_seconds": entry["start"], "end_seconds": entry["end"], "rooms[]": entry["room"]}
+            get = lambda key, default="": str(values.get(key, default))
+            name = entry["name"]
+        room = get("rooms[]")
+        self.reply(f"""<html><body>
+<form id="main" method="post" action="edit_entry_handler.php">
+<input type="hidden" name="csrf_token" value="fake-token">
+<input type="hidden" name="id" value="{html.escape(entry_id)}">
+<input type="hidden" name="area" value="{html.escape(get('area'))}">
+<input type="hidden" name="start_date" value="{html.escape(get('start_date'))}">
+<input type="hidden" name="start_seconds" value="{html.escape(get('start_seconds'))}">
+<input type="hidden" name="end_seconds" value="{html.escape(get('end_seconds'))}">
+<select name="rooms[]" multiple><option value="{html.escape(room)}" selected>{html.escape(room)}</option></select>
+<input id="name" name="name" value="{html.escape(name)}">
+<textarea id="description" name="description"></textarea>
+<select id="type" name="type"><option value="I">Internal</option><option value="W">Walk-in</option></select>
+<input id="f_phone" name="f_phone"><input id="f_email" name="f_email">
+<span id="conflict_check" title=""></span><span id="policy_check" title=""></span>
+<input type="submit" class="default_action" value="Save">
+</form>
+<script>
+fetch("edit_entry_handler.php", {{method: "POST", body: new URLSearchParams(
+    [...new FormData(document.getElementById("main")), ["ajax", "1"]])}})
+  .then(response => response.json())
+  .then(result => {{
+    document.getElementById("conflict_check").title =
+        result.conflicts.length ? result.conflicts.join("\\n") : "No scheduling conflicts";
+    document.getElementById("policy_check").title =
+        result.violations.errors.length ? result.violations.errors.join("\\n") : "No policy conflicts";
+  }});
+</script></body></html>""")
+
+    def edit_entry_handler(self, form):
+        if not self.logged_in():
+            return self.reply("Not logged in", 403)
+        get = lambda key: form.get(key, [""])[0]
+        try:
+            room = int(get("rooms[]"))
+            start = int(get("start_seconds"))
+            end = int(get("end_seconds"))
+        except ValueError:
+            return self.reply("Bad request", 400)
+        date = get("start_date")
+        entry_id = int(get("id")) if get("id") else None
+        if self.site.injected_error():
+            if get("ajax") != "1" and entry_id is None and random.random() < 0.5 \
+                    and not any(self.site.check(room, date, start, end)):
+                # Booked, but the answer never makes it back
+                self.site.add_entry(room, date, start, end, get("name"))
+            return self.reply("Service unavailable", 503)
+        conflicts, errors = self.site.check(room, date, start, end, exclude=entry_id)
+
+        if get("ajax") == "1":
+            return self.reply(json.dumps({
+                "valid_booking": not conflicts and not errors,
+                "conflicts": conflicts,
+                "violations": {"errors": errors, "notices": []},
+            }), content_type="application/json")
+
+        if conflicts or errors:
+            items = "".join(f"<li>{html.escape(item)}</li>" for item in conflicts + errors)
+            return self.reply(f"<html><body><h2>Booking failed</h2><ul>{items}</ul></body></html>")
+        if entry_id is not None:
+            self.site.update_entry(entry_id, room, date, start, end)
+        else:
+            self.site.add_entry(room, date, start, end, get("name"))
+        self.redirect(f"{PREFIX}index.php?view=day&page_date={date}&area={get('area')}")
+
+    def view_entry(self, query):
+        if not self.logged_in():
+            return self.home()
+        entry = self.site.entry(int(query.get("id", ["0"])[0] or 0))
+        if entry is None:
+            return self.reply("No such entry", 404)
+        self.reply(f"""<html><body><h2>{html.escape(entry["name"])}</h2>
+<form action="del_entry.php" method="post">
+<input type="hidden" name="csrf_token" value="fake-token">
+<input type="hidden" name="id" value="{entry["id"]}">
+<input type="hidden" name="series" value="0">
+<input type="submit" value="Delete Booking">
+</form></body></html>""")
+
+    def del_entry(self, form):
+        if not self.logged_in():
+            return self.reply("Not logged in", 403)
+        entry = self.site.entry(int(form.get("id", ["0"])[0] or 0))
+        if entry is None:
+            return self.reply("No such entry", 404)
+        self.site.remove_entry(entry["id"])
+        self.redirect(f"{PREFIX}index.php?view=day&page_date={entry['date']}&area={self.site.area_of(entry['room'])}")
+
+    def day_view(self, query):
+        date = query.get("page_date", [""])[0]
+        area = int(query.get("area", ["0"])[0] or 0)
+        rooms = self.site.rooms.get(area, [])
+        with self.site.lock:
+            entries = [entry for entry in self.site.entries
+                       if entry["date"] == date and entry["room"] in rooms]
+
+        header = "".join(f'<th data-room="{room}">{html.escape(self.site.labels.get(room, str(room)))}</th>'
+                         for room in rooms)
+        rows = []
+        covered = {}   # room -> slot where its current booking ends
+        for slot in range(DAY_START, DAY_END, RESOLUTION):
+            cells = []
+            for room in rooms:
+                if covered.get(room, 0) > slot:
+                    continue
+                entry = next((e for e in entries if e["room"] == room and e["start"] <= slot < e["end"]), None)
+                if entry:
+                    span = -(-(entry["end"] - slot) // RESOLUTION)
+                    covered[room] = slot + span * RESOLUTION
+                    cells.append(f'<td class="W" rowspan="{span}"><div data-id="{entry["id"]}">'
+                                 f'<a href="view_entry.php?id={entry["id"]}">{html.escape(entry["name"])}</a></div></td>')
+                else:
+                    cells.append(f'<td class="new"><a href="edit_entry.php?room={room}&start_seconds={slot}">+</a></td>')
+            label = f"{slot // 3600 % 24:02d}:{slot % 3600 // 60:02d}"
+            rows.append(f'<tr><th data-seconds="{slot}">{label}</th>{"".join(cells)}</tr>')
+
+        body = f"""<html><body><table class="dwm_main" id="day_main" data-resolution="{RESOLUTION}">
+<thead><tr><th>Time</th>{header}</tr></thead><tbody>{"".join(rows)}</tbody></table></body></html>"""
+        etag = f'"{zlib.crc32(body.encode()):08x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.site.day_views += 1
+        self.reply(body, headers=[("ETag", etag)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for bookings.ok.ubc.ca")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds on top of the latency")
+    parser.add_argument("--conflict-rate", type=float, default=0.0, help="Share of slots already booked by others")
+    parser.add_argument("--max-bookings", type=int, default=None, help="Enforce a maximum number of bookings")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of booking requests failing with a 503")
+    args = parser.parse_args()
+
+    site = FakeMRBS(args.port, args.latency, args.jitter, args.conflict_rate, args.max_bookings,
+                    error_rate=args.error_rate)
+    print(f"Fake MRBS listening on {site.base_url}")
+    try:
+        site.server.serve_forever()
+    except KeyboardInterrupt:
+        site.stop()
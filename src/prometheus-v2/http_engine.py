@@ -0,0 +1,311 @@
+"""Browserless booking engine, talks to MRBS directly over a pooled requests.Session"""
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+import mrbs
+import retry
+import tracing
+
+# Same timeout budget the Selenium path gives WebDriverWait
+TIMEOUT = 10
+PREFLIGHT_WORKERS = 6   # Slot checks in flight at once on the pre-flight session
+
+
+class FormParser(HTMLParser):
+    """Collect the fields of the edit_entry.php booking form, or of the first form posting to action"""
+
+    def __init__(self, form_id="main", action="edit_entry_handler"):
+        super().__init__()
+        self.form_id = form_id
+        self.action_match = action
+        self.action = None
+        self.fields = []
+        self.in_form = False
+        self.select_name = None
+        self.select_options = []
+        self.textarea_name = None
+        self.textarea_value = ""
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form" and self.action is None:
+            if (self.form_id and attrs.get("id") == self.form_id) or self.action_match in attrs.get("action", ""):
+                self.in_form = True
+                self.action = attrs.get("action", f"{self.action_match}.php")
+            return
+        if not self.in_form:
+            return
+
+        name = attrs.get("name")
+        if tag == "input" and name:
+            input_type = attrs.get("type", "text").lower()
+            if input_type in ("submit", "button", "image", "reset"):
+                return
+            if input_type in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            self.fields.append((name, attrs.get("value", "")))
+        elif tag == "select" and name:
+            self.select_name = name
+            self.select_options = []
+        elif tag == "option" and self.select_name:
+            self.select_options.append((attrs.get("value", ""), "selected" in attrs))
+        elif tag == "textarea" and name:
+            self.textarea_name = name
+            self.textarea_value = ""
+
+    def handle_data(self, data):
+        if self.textarea_name:
+            self.textarea_value += data
+
+    def handle_endtag(self, tag):
+        if tag == "form" and self.in_form:
+            self.in_form = False
+        elif tag == "select" and self.select_name:
+            selected = [value for value, chosen in self.select_options if chosen]
+            # A single select falls back to its first option like a browser would
+            if not selected and self.select_options and not self.select_name.endswith("[]"):
+                selected = [self.select_options[0][0]]
+            for value in selected:
+                self.fields.append((self.select_name, value))
+            self.select_name = None
+        elif tag == "textarea" and self.textarea_name:
+            self.fields.append((self.textarea_name, self.textarea_value))
+            self.textarea_name = None
+
+
+def create_session(cookies=(), user_agent=None, pool_size=4):
+    """Create a keep-alive session carrying the given Selenium-style cookies"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if user_agent:
+        session.headers["User-Agent"] = user_agent
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"],
+                            domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+    return session
+
+
+def session_from_driver(driver, pool_size=4):
+    """Create a session that reuses the cookies of a logged-in driver"""
+    user_agent = driver.execute_script("return navigator.userAgent")
+    return create_session(driver.get_cookies(), user_agent, pool_size)
+
+
+def session_cookies(session):
+    """The session's cookies in the Selenium format the session cache stores"""
+    cookies = []
+    for c in session.cookies:
+        cookie = {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "secure": c.secure}
+        if c.expires:
+            cookie["expiry"] = c.expires
+        cookies.append(cookie)
+    return cookies
+
+
+def fetch_form(session, url):
+    """GET edit_entry.php and return (action_url, fields)"""
+    response = session.get(url, timeout=TIMEOUT)
+    response.raise_for_status()
+    parser = FormParser()
+    parser.feed(response.text)
+    if parser.action is None:
+        raise Exception("Booking form not found, is the session still logged in?")
+    return urljoin(response.url, parser.action), parser.fields
+
+
+def fill_form(fields, room_data):
+    """Replace the user-editable fields the same way the Selenium engine types them"""
+    values = {
+        "name": room_data["room_title"],
+        "description": room_data["room_description"],
+        "type": "W",
+        "f_phone": room_data["phone_number"],
+        "f_email": room_data["email"],
+    }
+    filled = [(name, value) for name, value in fields if name not in values]
+    filled.extend(values.items())
+    return filled
+
+
+def check_slot(session, action, fields):
+    """Run the conflict/policy check the form does over AJAX, returns (conflict_title, policy_title)"""
+    response = session.post(action, data=fields + [("ajax", "1")], timeout=TIMEOUT)
+    response.raise_for_status()
+    result = response.json()
+
+    conflicts = result.get("conflicts") or []
+    violations = result.get("violations") or {}
+    if isinstance(violations, dict):
+        errors = violations.get("errors") or []
+    else:
+        errors = violations
+
+    conflict_title = "\n".join(conflicts) if conflicts else mrbs.NO_CONFLICTS
+    policy_title = "\n".join(errors) if errors else mrbs.NO_POLICY_CONFLICTS
+    return conflict_title, policy_title
+
+
+def slot_fields(fields, room_data, start_time, end_time):
+    """Point a loaded form at another room, date or time"""
+    values = {
+        "area": str(room_data["area"]),
+        "rooms[]": str(room_data["room"]),
+        "start_date": room_data["date"],
+        "end_date": room_data["date"],
+        "start_seconds": str(start_time),
+        "end_seconds": str(end_time),
+    }
+    return [(name, values.get(name, value)) for name, value in fields]
+
+
+class SlotChecker:
+    """Runs the booking form's conflict/policy check for any slot without loading a form per slot
+
+    The form is loaded once for its hidden fields (CSRF token and the like),
+    after that every check is a single POST on one pooled session.
+    """
+
+    def __init__(self, session, workers=PREFLIGHT_WORKERS):
+        self.session = session
+        self.template = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preflight")
+
+    def form_template(self, room_data, start_time, end_time):
+        with self.lock:
+            if self.template is None:
+                with tracing.span("http.get"):
+                    self.template = fetch_form(self.session, mrbs.entry_url(room_data, start_time, end_time))
+            return self.template
+
+    def check(self, room_data, start_time, end_time):
+        """Check one slot, returns a slot result that is FREE when it can be booked"""
+        try:
+            action, fields = self.form_template(room_data, start_time, end_time)
+            fields = fill_form(slot_fields(fields, room_data, start_time, end_time), room_data)
+            with tracing.span("http.preflight"):
+                conflict_title, policy_title = check_slot(self.session, action, fields)
+        except Exception as e:
+            return mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR, error=str(e),
+                                    transient=retry.is_transient(e))
+        status = mrbs.check_outcome(conflict_title, policy_title) or mrbs.FREE
+        return mrbs.slot_result(room_data, start_time, end_time, status, conflict_title, policy_title)
+
+    def submit(self, room_data, start_time, end_time):
+        return self.executor.submit(self.check, room_data, start_time, end_time)
+
+    def check_all(self, slots):
+        """Check (room_data, start_time, end_time) slots in parallel, results in the same order"""
+        return list(self.executor.map(lambda slot: self.check(*slot), slots))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+def submit_form(session, action, fields):
+    """POST the booking, returns True when MRBS accepted it"""
+    response = session.post(action, data=fields, timeout=TIMEOUT)
+    response.raise_for_status()
+    # MRBS redirects back to the calendar on success and re-renders the handler on failure
+    return "edit_entry_handler.php" not in response.url
+
+
+def book_slot(session, room_data, start_time, end_time, submit=True):
+    """Book one slot over HTTP, returns the same result as chronos.book_slot"""
+    submitted = False
+    try:
+        with tracing.span("http.get"):
+            action, fields = fetch_form(session, mrbs.entry_url(room_data, start_time, end_time))
+        fields = fill_form(fields, room_data)
+
+        with tracing.span("http.check"):
+            conflict_title, policy_title = check_slot(session, action, fields)
+        status = mrbs.check_outcome(conflict_title, policy_title)
+        if status is not None:
+            return mrbs.slot_result(room_data, start_time, end_time, status,
+                                    conflict_title, policy_title)
+        if not submit:
+            return mrbs.slot_result(room_data, start_time, end_time, mrbs.FREE,
+                                    conflict_title, policy_title)
+
+        submitted = True
+        submitted_at = time.perf_counter()
+        with tracing.span("http.submit"):
+            accepted = submit_form(session, action, fields)
+        if not accepted:
+            return mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR,
+                                    conflict_title, policy_title, "Booking was not accepted",
+                                    submitted_at=submitted_at)
+        return mrbs.slot_result(room_data, start_time, end_time, mrbs.BOOKED,
+                                conflict_title, policy_title, submitted_at=submitted_at)
+
+    except Exception as e:
+        return mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR, error=str(e),
+                                transient=retry.is_transient(e), submitted=submitted)
+
+
+def cancel_entry(session, entry):
+    """Delete one booking found on the day view, returns a slot result that is RELEASED once it is gone
+
+    entry is a day view entry plus its "date" and "area".
+    """
+    try:
+        with tracing.span("http.get"):
+            response = session.get(mrbs.view_entry_url(entry["id"]), timeout=TIMEOUT)
+            response.raise_for_status()
+        parser = FormParser(form_id=None, action="del_entry")
+        parser.feed(response.text)
+
+        with tracing.span("http.cancel"):
+            if parser.action is not None:
+                response = session.post(urljoin(response.url, parser.action), data=parser.fields, timeout=TIMEOUT)
+            else:
+                # Older MRBS versions delete with a plain link
+                response = session.get(f"{mrbs.BASE_URL}del_entry.php?id={entry['id']}&series=0", timeout=TIMEOUT)
+            response.raise_for_status()
+        # Like the booking handler, a successful delete redirects back to the calendar
+        if "del_entry.php" in response.url:
+            return mrbs.slot_result(entry, entry["start"], entry["end"], mrbs.ERROR,
+                                    error="Cancellation was not accepted")
+        return mrbs.slot_result(entry, entry["start"], entry["end"], mrbs.RELEASED)
+    except Exception as e:
+        return mrbs.slot_result(entry, entry["start"], entry["end"], mrbs.ERROR, error=str(e),
+                                transient=retry.is_transient(e))
+
+
+def move_entry(session, entry, room_data, start_time, end_time):
+    """Edit one booking in place to another room, date or time, keeping its title and id
+
+    room_data gives the new "area", "room" and "date". Returns a slot result for
+    the new slot, BOOKED when the move went through.
+    """
+    submitted = False
+    try:
+        with tracing.span("http.get"):
+            action, fields = fetch_form(session, mrbs.edit_entry_url(entry["id"]))
+        fields = slot_fields(fields, room_data, start_time, end_time)
+
+        # The check leaves the booking itself out, so a move that overlaps its old slot is fine
+        with tracing.span("http.check"):
+            conflict_title, policy_title = check_slot(session, action, fields)
+        status = mrbs.check_outcome(conflict_title, policy_title)
+        if status is not None:
+            return mrbs.slot_result(room_data, start_time, end_time, status, conflict_title, policy_title)
+
+        submitted = True
+        with tracing.span("http.submit"):
+            accepted = submit_form(session, action, fields)
+        if not accepted:
+            return mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR,
+                                    conflict_title, policy_title, "Move was not accepted")
+        return mrbs.slot_result(room_data, start_time, end_time, mrbs.BOOKED, conflict_title, policy_title)
+    except Exception as e:
+        return mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR, error=str(e),
+                                transient=retry.is_transient(e), submitted=submitted)
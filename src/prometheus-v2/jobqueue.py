@@ -0,0 +1,162 @@
+"""Persistent booking job queue in SQLite, shared by the daemon and the submit command"""
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from policy import opens_at, timestamp
+
+QUEUE_FILE = "jobs.db"
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+EXPIRED = "expired"   # Its deadline passed before it could start
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    deadline REAL,
+    opens_at REAL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_order ON jobs (status, priority DESC, deadline, id);
+"""
+
+# Columns added since the first schema, with how to fill them in for existing jobs
+MIGRATIONS = {
+    "opens_at": opens_at,
+}
+
+
+def slot_deadline(job):
+    """Timestamp a job is worthless after: the start of the booking it asks for"""
+    return timestamp(job["date"], job["start_time"])
+
+
+class JobQueue:
+    """Jobs are claimed highest priority first, then earliest deadline, then oldest
+
+    A job is only claimed once its booking window is about to open, and it can
+    be cancelled until then, claimed or not.
+    """
+
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+            self.migrate(db)
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            # WAL lets the submit command write while the daemon reads
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def migrate(self, db):
+        """Add the columns a jobs.db from an older version lacks"""
+        # Under the write lock, so a daemon and a submit starting together do not both add a column
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, fill in MIGRATIONS.items():
+                if column in columns:
+                    continue
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {column} REAL")
+                for row in db.execute("SELECT id, job FROM jobs").fetchall():
+                    db.execute(f"UPDATE jobs SET {column} = ? WHERE id = ?",
+                               (fill(json.loads(row["job"])), row["id"]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def submit(self, job, priority=0, deadline=None):
+        """Add a job, returns its id"""
+        if deadline is None:
+            deadline = slot_deadline(job)
+        with self.connect() as db:
+            cursor = db.execute(
+                "INSERT INTO jobs (job, priority, deadline, opens_at, submitted_at) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(job), priority, deadline, opens_at(job), time.time()))
+            return cursor.lastrowid
+
+    def claim(self, now=None):
+        """Mark the next job whose window opens by now running and return it, None if there is none"""
+        now = time.time() if now is None else now
+        with self.connect() as db:
+            # BEGIN IMMEDIATE takes the write lock first, so two daemons never claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND (opens_at IS NULL OR opens_at <= ?) "
+                    "ORDER BY priority DESC, deadline IS NULL, deadline, id LIMIT 1", (QUEUED, now)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                               (RUNNING, time.time(), row["id"]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self.to_dict(row) if row is not None else None
+
+    def finish(self, job_id, status, result=None):
+        """Record how a running job ended, a job cancelled meanwhile stays cancelled"""
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET status = ?, finished_at = ?, result = ? WHERE id = ? AND status = ?",
+                       (status, time.time(), json.dumps(result), job_id, RUNNING))
+
+    def status(self, job_id):
+        with self.connect() as db:
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row is not None else None
+
+    def cancel(self, job_id, now=None):
+        """Cancel a job that has not started yet, True if it was queued or claimed ahead of its window"""
+        now = time.time() if now is None else now
+        with self.connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? "
+                "AND (status = ? OR (status = ? AND opens_at > ?))",
+                (CANCELLED, now, job_id, QUEUED, RUNNING, now))
+            return cursor.rowcount == 1
+
+    def requeue(self, job_id):
+        """Put a claimed job back, for a daemon that stops before starting it"""
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE id = ? AND status = ?",
+                       (QUEUED, job_id, RUNNING))
+
+    def recover(self):
+        """Requeue jobs left running by a daemon that died, returns how many"""
+        with self.connect() as db:
+            return db.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?",
+                              (QUEUED, RUNNING)).rowcount
+
+    def jobs(self, status=None):
+        with self.connect() as db:
+            if status is None:
+                rows = db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            else:
+                rows = db.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)).fetchall()
+        return [self.to_dict(row) for row in rows]
+
+    @staticmethod
+    def to_dict(row):
+        item = dict(row)
+        item["job"] = json.loads(item["job"])
+        item["result"] = json.loads(item["result"]) if item["result"] else None
+        return item
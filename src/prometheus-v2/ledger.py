@@ -0,0 +1,159 @@
+"""Local SQLite ledger of every booking attempt, used to know the remaining quota and what we already hold
+
+    python ledger.py              # Active bookings and remaining quota
+    python ledger.py --reconcile  # Check them against the day view first
+"""
+import argparse
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import mrbs
+import policy
+
+LEDGER_FILE = "ledger.db"
+MISSING = "missing"   # Was booked, but no longer on the day view
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room INTEGER NOT NULL,
+    requested_room INTEGER,
+    area INTEGER,
+    date TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    starts_at REAL NOT NULL,
+    ends_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    title TEXT,
+    engine TEXT,
+    latency_ms REAL,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_slot ON attempts (room, date, start_time);
+CREATE INDEX IF NOT EXISTS attempts_active ON attempts (status, ends_at);
+"""
+
+
+class Ledger:
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def record(self, result, title=None, engine=None, latency_ms=None):
+        """Store one per-slot result"""
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO attempts (room, requested_room, area, date, start_time, end_time, starts_at, ends_at,"
+                " status, title, engine, latency_ms, error, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result["room"], result.get("requested_room"), result["area"], result["date"],
+                 result["start_time"], result["end_time"],
+                 policy.timestamp(result["date"], result["start_time"]),
+                 policy.timestamp(result["date"], result["end_time"]),
+                 result["status"], title, engine, latency_ms, result.get("error", ""), time.time()))
+
+    def active(self, now=None):
+        """Bookings that have not ended yet, these count against the quota"""
+        now = time.time() if now is None else now
+        with self.connect() as db:
+            rows = db.execute("SELECT * FROM attempts WHERE status = ? AND ends_at > ? ORDER BY starts_at",
+                              (mrbs.BOOKED, now)).fetchall()
+        return [dict(row) for row in rows]
+
+    def active_count(self, now=None):
+        now = time.time() if now is None else now
+        with self.connect() as db:
+            return db.execute("SELECT COUNT(*) FROM attempts WHERE status = ? AND ends_at > ?",
+                              (mrbs.BOOKED, now)).fetchone()[0]
+
+    def remaining(self, limit=mrbs.MAX_BOOKINGS):
+        return max(0, limit - self.active_count())
+
+    def holds(self, room, date, start_time, end_time):
+        """Whether one of our bookings already covers start_time..end_time in room"""
+        with self.connect() as db:
+            return db.execute(
+                "SELECT 1 FROM attempts WHERE room = ? AND date = ? AND status = ?"
+                " AND start_time <= ? AND end_time >= ? LIMIT 1",
+                (room, date, mrbs.BOOKED, start_time, end_time)).fetchone() is not None
+
+    def release(self, room, date, start_time, end_time):
+        """Mark our bookings inside start_time..end_time in room as released, returns how many"""
+        with self.connect() as db:
+            return db.execute(
+                "UPDATE attempts SET status = ? WHERE room = ? AND date = ? AND status = ?"
+                " AND start_time >= ? AND end_time <= ?",
+                (mrbs.RELEASED, room, date, mrbs.BOOKED, start_time, end_time)).rowcount
+
+    def reconcile(self, session):
+        """Check active bookings against the day view, marking the ones gone from it as missing
+
+        Returns the bookings that were marked missing.
+        """
+        from availability import fetch_day_view, find_entry
+
+        grids = {}
+        missing = []
+        for booking in self.active():
+            key = (booking["date"], booking["area"])
+            if key not in grids:
+                grids[key] = fetch_day_view(session, *key)
+            if find_entry(grids[key], booking["room"], booking["start_time"], booking["end_time"]) is None:
+                missing.append(booking)
+
+        with self.connect() as db:
+            for booking in missing:
+                db.execute("UPDATE attempts SET status = ? WHERE id = ?", (MISSING, booking["id"]))
+        return missing
+
+
+ledger = None
+ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Process wide ledger on LEDGER_FILE"""
+    global ledger
+    with ledger_lock:
+        if ledger is None:
+            ledger = Ledger()
+        return ledger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the booking ledger")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Check active bookings against the day view (needs a saved session)")
+    args = parser.parse_args()
+
+    if args.reconcile:
+        import http_engine
+        import session_cache
+
+        state = session_cache.load_session()
+        if state is None:
+            raise SystemExit("No saved session, book once or run the daemon to log in")
+        session = http_engine.create_session(state["cookies"], state.get("user_agent"), pool_size=1)
+        for booking in get_ledger().reconcile(session):
+            print(f"No longer on the day view: room {booking['room']} on {booking['date']} "
+                  f"{policy.format_seconds(booking['start_time'])}-{policy.format_seconds(booking['end_time'])}")
+
+    active = get_ledger().active()
+    print(f"{len(active)} active booking(s), {get_ledger().remaining()} of {mrbs.MAX_BOOKINGS} left")
+    for booking in active:
+        print(f"  room {booking['room']} on {booking['date']} "
+              f"{policy.format_seconds(booking['start_time'])}-{policy.format_seconds(booking['end_time'])}")
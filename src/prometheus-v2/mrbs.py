@@ -0,0 +1,83 @@
+"""Shared constants and helpers for the MRBS study room site"""
+import os
+
+# Point PROMETHEUS_BASE_URL at fake_mrbs.py to run everything against a local server
+BASE_URL = os.environ.get("PROMETHEUS_BASE_URL", "https://bookings.ok.ubc.ca/studyrooms/")
+
+# Site rules
+MAX_BOOKINGS = 3          # Active bookings allowed per user
+MAX_SESSION = 7200        # Longest single booking in seconds (2 hours)
+
+# Titles the edit form puts on #conflict_check / #policy_check when a slot is clear
+NO_CONFLICTS = "No scheduling conflicts"
+NO_POLICY_CONFLICTS = "No policy conflicts"
+
+# Per-slot outcomes
+BOOKED = "booked"
+FREE = "free"             # Checks passed but the booking was not submitted
+CONFLICT = "conflict"
+LIMIT = "limit"
+TOO_EARLY = "too_early"   # The site's 3 week window has not reached the slot yet, our clock ran ahead
+ERROR = "error"
+CANCELLED = "cancelled"
+REJECTED = "rejected"     # Refused by policy.validate, never sent to the site
+HELD = "held"             # Already ours according to the ledger, nothing sent
+RELEASED = "released"     # One of our bookings, deleted on the site by a bulk cancel
+
+
+def entry_url(room_data, start_time, end_time):
+    """Build the edit_entry.php URL for one slot"""
+    return (
+        f"{BASE_URL}edit_entry.php?drag=1"
+        f"&area={room_data['area']}"
+        f"&start_seconds={start_time}"
+        f"&end_seconds={end_time}"
+        f"&rooms[]={room_data['room']}"
+        f"&start_date={room_data['date']}"
+        f"&top=0"
+    )
+
+
+def view_entry_url(entry_id):
+    return f"{BASE_URL}view_entry.php?id={entry_id}"
+
+
+def edit_entry_url(entry_id):
+    """The edit form of an existing booking, prefilled with its fields and id"""
+    return f"{BASE_URL}edit_entry.php?id={entry_id}"
+
+
+def day_url(date, area):
+    """Build the day view URL for an area"""
+    return f"{BASE_URL}index.php?view=day&page_date={date}&area={area}"
+
+
+def check_outcome(conflict_title, policy_title):
+    """Classify the conflict/policy titles, returns None when the slot can be booked"""
+    if conflict_title == NO_CONFLICTS and policy_title == NO_POLICY_CONFLICTS:
+        return None
+    if "maximum" in policy_title:
+        return LIMIT
+    if "3 weeks" in policy_title:
+        return TOO_EARLY
+    return CONFLICT
+
+
+def slot_result(room_data, start_time, end_time, status,
+                conflict="", policy="", error="", transient=False, submitted=False, submitted_at=None):
+    """Per-slot result shared by every booking engine"""
+    return {
+        "area": room_data["area"],
+        "room": room_data["room"],
+        "requested_room": room_data.get("requested_room", room_data["room"]),   # Differs after a fallback
+        "date": room_data["date"],
+        "start_time": start_time,
+        "end_time": end_time,
+        "status": status,
+        "conflict": conflict,
+        "policy": policy,
+        "error": error,
+        "transient": transient,   # The error may go away if the slot is tried again
+        "submitted": submitted,   # The error came after the booking was sent, it may have gone through
+        "submitted_at": submitted_at,   # time.perf_counter() when the booking went out, if it did
+    }
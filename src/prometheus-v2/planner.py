@@ -0,0 +1,203 @@
+"""Quota-aware planner that spreads the 3 allowed bookings over dates, rooms and time windows"""
+import argparse
+from datetime import datetime, timedelta
+import mrbs
+from availability import RESOLUTION
+from catalog import get_catalog
+
+MAX_SLOTS = mrbs.MAX_SESSION // RESOLUTION   # 30 minute slots in one booking
+
+
+def date_range(start, end):
+    """Every date from start to end inclusive, as YYYY-MM-DD"""
+    day = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    dates = []
+    while day <= last:
+        dates.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return dates
+
+
+def weekly(start, weeks):
+    """The same weekday as start for the given number of weeks"""
+    day = datetime.strptime(start, "%Y-%m-%d")
+    return [(day + timedelta(weeks=week)).strftime("%Y-%m-%d") for week in range(weeks)]
+
+
+def free_room(availability, rooms, date, start_time, end_time):
+    """First preferred room free for the whole range, unknown counts as free"""
+    for room in rooms:
+        if availability is None or availability.is_free(room, date, start_time, end_time) is not False:
+            return room
+    return None
+
+
+def plan_window(availability, rooms, date, window, quota):
+    """Best coverage of one window with 0..quota bookings
+
+    best[j] is (covered slots, segments) using exactly j bookings, each segment
+    is at most 2 hours and must fit in one free room. Classic interval DP over
+    the 30 minute slots of the window.
+    """
+    start, end = window
+    slots = list(range(start - start % RESOLUTION, end, RESOLUTION))
+    count = len(slots)
+
+    # Room to book slots[a:b] in, only segments some preferred room is free for
+    def segment_room(a, b):
+        return free_room(availability, rooms, date, slots[a], min(slots[b - 1] + RESOLUTION, end))
+
+    rooms_for = {}
+    for b in range(1, count + 1):
+        for a in range(max(0, b - MAX_SLOTS), b):
+            room = segment_room(a, b)
+            if room is not None:
+                rooms_for[(a, b)] = room
+
+    # covered[i][j]: most slots covered in slots[:i] with j bookings, choice[i][j] to rebuild
+    covered = [[-1] * (quota + 1) for _ in range(count + 1)]
+    choice = [[None] * (quota + 1) for _ in range(count + 1)]
+    covered[0][0] = 0
+    for i in range(1, count + 1):
+        for j in range(quota + 1):
+            covered[i][j] = covered[i - 1][j]
+            choice[i][j] = None
+            if j == 0:
+                continue
+            for a in range(max(0, i - MAX_SLOTS), i):
+                if (a, i) in rooms_for and covered[a][j - 1] >= 0:
+                    value = covered[a][j - 1] + (i - a)
+                    if value > covered[i][j]:
+                        covered[i][j] = value
+                        choice[i][j] = a
+
+    best = []
+    for j in range(quota + 1):
+        segments = []
+        i, k = count, j
+        if covered[count][j] < 0:
+            best.append((-1, []))
+            continue
+        while i > 0:
+            a = choice[i][k]
+            if a is None:
+                i -= 1
+                continue
+            segments.append((rooms_for[(a, i)], slots[a], min(slots[i - 1] + RESOLUTION, end)))
+            i, k = a, k - 1
+        best.append((covered[count][j], segments[::-1]))
+    return best
+
+
+def plan_bookings(dates, rooms, windows, availability=None, quota=mrbs.MAX_BOOKINGS):
+    """Choose the bookings that cover the most requested time within the quota
+
+    Returns (plan, covered seconds, requested seconds), the plan being a list of
+    (room, date, start_time, end_time).
+    """
+    # Knapsack over windows: total[k] = (covered slots, segments) with k bookings overall
+    total = [(0, [])] + [(-1, [])] * quota
+    for date in dates:
+        for window in windows:
+            best = plan_window(availability, rooms, date, window, quota)
+            merged = list(total)
+            for used, (value, segments) in enumerate(total):
+                if value < 0:
+                    continue
+                for j, (window_value, window_segments) in enumerate(best):
+                    if j == 0 or window_value < 0 or used + j > quota:
+                        continue
+                    candidate = value + window_value
+                    # Ties go to the plan that uses fewer bookings
+                    if candidate > merged[used + j][0]:
+                        merged[used + j] = (candidate, segments + [
+                            (room, date, start_time, end_time)
+                            for room, start_time, end_time in window_segments])
+            total = merged
+
+    value, plan = max(total, key=lambda option: (option[0], -len(option[1])))
+    requested = sum(end - start for start, end in windows) * len(dates)
+    return plan, max(value, 0) * RESOLUTION, requested
+
+
+def plan_jobs(plan, room_data, availability=None):
+    """Turn a plan into BookingEngine jobs using the booking details from room_data"""
+    rooms_catalog = get_catalog()
+    jobs = []
+    for room, date, start_time, end_time in plan:
+        job = dict(room_data)
+        area = rooms_catalog.room(room).area_id if rooms_catalog.room(room) else None
+        if area is None and availability is not None:
+            area = availability.area_of(room)
+        job.update({
+            "area": area if area is not None else room_data["area"],
+            "room": room,
+            "date": date,
+            "start_time": start_time,
+            "end_time": end_time,
+        })
+        jobs.append(job)
+    return jobs
+
+
+def execute_plan(jobs, booking_engine):
+    """Run every booking of the plan through one engine, so one authenticated session"""
+    return booking_engine.run(jobs)
+
+
+def parse_window(text):
+    start, end = text.split("-")
+    to_seconds = lambda t: int(t.split(":")[0]) * 3600 + int(t.split(":")[1]) * 60
+    return to_seconds(start), to_seconds(end)
+
+
+if __name__ == "__main__":
+    import chronos
+    import config_store
+    import http_engine
+    from availability import AvailabilityIndex
+    from driver_pool import get_pool, close_pool
+    from engine import BookingEngine
+    from ledger import get_ledger
+
+    parser = argparse.ArgumentParser(description="Plan and book several days at once")
+    parser.add_argument("start", help="First date, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="Last date, YYYY-MM-DD (default: same day)")
+    parser.add_argument("--weekly", type=int, metavar="WEEKS",
+                        help="Book the start date's weekday for this many weeks instead of a range")
+    parser.add_argument("--room", type=int, action="append", required=True,
+                        help="Preferred room id, repeat in order of preference")
+    parser.add_argument("--window", action="append", required=True,
+                        help="Wanted time window HH:MM-HH:MM, can be repeated")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the plan")
+    args = parser.parse_args()
+
+    dates = weekly(args.start, args.weekly) if args.weekly else date_range(args.start, args.end or args.start)
+    windows = [parse_window(window) for window in args.window]
+
+    try:
+        with get_pool().lease() as driver:
+            session = http_engine.session_from_driver(driver)
+            try:
+                availability = AvailabilityIndex(session)
+                availability.refresh(dates)
+
+                # Only plan with the bookings the ledger says are still free
+                plan, covered, requested = plan_bookings(dates, args.room, windows, availability,
+                                                         quota=get_ledger().remaining())
+                print(f"Plan covers {covered / 3600:.1f}h of {requested / 3600:.1f}h requested:")
+                for room, date, start_time, end_time in plan:
+                    print(f"  room {room} on {date} {chronos.convert_seconds_to_time(start_time)}"
+                          f" - {chronos.convert_seconds_to_time(end_time)}")
+
+                if not args.dry_run:
+                    jobs = plan_jobs(plan, config_store.load(), availability)
+                    with BookingEngine.from_driver(driver, engine="http", workers=len(jobs) or 1,
+                                                   on_result=chronos.print_slot_result,
+                                                   availability=availability, ledger=get_ledger()) as booking_engine:
+                        execute_plan(jobs, booking_engine)
+            finally:
+                session.close()
+    finally:
+        close_pool()
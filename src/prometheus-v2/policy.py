@@ -0,0 +1,177 @@
+"""Booking policy table and a local validator that refuses impossible requests before any network I/O"""
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import config
+import mrbs
+import tracing
+from catalog import get_catalog
+
+SERVER_TZ = ZoneInfo("America/Vancouver")
+HORIZON = timedelta(weeks=3)                          # The "3 weeks" advance booking policy
+MAX_REQUEST = mrbs.MAX_BOOKINGS * mrbs.MAX_SESSION    # Longest request the quota can ever cover (6 hours)
+STEP = 1800                                           # The GUI offers times every 30 minutes
+
+# Opening hours per area, by the part of the area name before the colon:
+# (first start, last start, closing time) in seconds from midnight, closing may run past midnight
+OPENING_HOURS = {
+    "EME": (7 * 3600, 20 * 3600, 20 * 3600 + 1800),
+    "Library": (7 * 3600, 21 * 3600 + 1800, 22 * 3600),
+}
+DEFAULT_HOURS = (6 * 3600, 23 * 3600 + 1800, 24 * 3600 + 1800)
+
+# Why a request, or part of it, was refused locally
+REASONS = {
+    "closed": "Outside opening hours",
+    "too_long": "Longer than the 6 hour booking limit",
+    "past": "Already over",
+    "horizon": "More than 3 weeks ahead",
+    "quota": "Booking limit reached",
+}
+
+counts = {}
+counts_lock = threading.Lock()
+
+
+def opening_hours(area_name):
+    return OPENING_HOURS.get((area_name or "").split(":")[0], DEFAULT_HOURS)
+
+
+def timestamp(date, seconds):
+    """Unix time of seconds past midnight on date, in the site's time zone"""
+    return datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=SERVER_TZ).timestamp() + seconds
+
+
+def opens_at(job):
+    """Unix time the first session of a job enters the booking window"""
+    return timestamp(job["date"], job["start_time"]) - HORIZON.total_seconds()
+
+
+def format_seconds(seconds):
+    return f"{seconds // 3600 % 24:02d}:{seconds % 3600 // 60:02d}"
+
+
+def build_slot_table(area_name):
+    """Start times and, per start time, the allowed end times for an area as "HH:MM" strings"""
+    first_start, last_start, closing = opening_hours(area_name)
+    starts = list(range(first_start, last_start + 1, STEP))
+    return {
+        "starts": [format_seconds(start) for start in starts],
+        "ends": {
+            format_seconds(start): [format_seconds(end) for end in
+                                    range(start + STEP, min(start + MAX_REQUEST, closing) + 1, STEP)]
+            for start in starts
+        },
+    }
+
+
+# Precomputed once, the GUI only ever looks these up
+SLOT_TABLES = {area_name: build_slot_table(area_name) for area_name in list(config.area_map) + [""]}
+
+
+def slot_table(area_name):
+    table = SLOT_TABLES.get(area_name)
+    if table is None:
+        table = SLOT_TABLES[area_name] = build_slot_table(area_name)
+    return table
+
+
+def start_slots(area_name):
+    return slot_table(area_name)["starts"]
+
+
+def end_slots(area_name, start):
+    return slot_table(area_name)["ends"].get(start, [])
+
+
+def is_open(area_id, start_time, end_time):
+    """Whether an area is open for the whole of start_time..end_time"""
+    first_start, last_start, closing = opening_hours(get_catalog().area_name(area_id))
+    return first_start <= start_time <= last_start and end_time <= closing
+
+
+def count(reason, sessions=1):
+    """Record sessions that were never sent to the site"""
+    with counts_lock:
+        counts[reason] = counts.get(reason, 0) + sessions
+    tracing.write({"event": "policy.reject", "reason": reason, "sessions": sessions})
+
+
+def rejections():
+    """Sessions refused locally so far, by reason"""
+    with counts_lock:
+        return dict(counts)
+
+
+def sessions_in(start_time, end_time):
+    return max(1, math.ceil((end_time - start_time) / mrbs.MAX_SESSION))
+
+
+def validate(job, now=None, record=True):
+    """Check a job against the policy table, trimming what cannot be booked
+
+    Returns (job, refused): the job cut down to what may be booked, or None if
+    nothing can be, and a list of (start_time, end_time, message) pieces that
+    were cut off. Every refused 2 hour session is counted unless record is False.
+    """
+    now = time.time() if now is None else now
+    area_name = get_catalog().area_name(job.get("area"))
+    first_start, last_start, closing = opening_hours(area_name)
+    start_time, end_time = job["start_time"], job["end_time"]
+    refused = []
+
+    def refuse(reason, start, end, message=None):
+        refused.append((start, end, message or REASONS[reason]))
+        if record:
+            count(reason, sessions_in(start, end))
+
+    closed = f"{area_name or 'This area'} is open {format_seconds(first_start)}-{format_seconds(closing)}"
+    if end_time <= start_time or start_time > last_start or end_time <= first_start:
+        refuse("closed", start_time, end_time, closed)
+        return None, sorted(refused)
+    if start_time < first_start:
+        refuse("closed", start_time, first_start, closed)
+        start_time = first_start
+    if end_time > closing:
+        refuse("closed", closing, end_time, closed)
+        end_time = closing
+
+    if end_time - start_time > MAX_REQUEST:
+        refuse("too_long", start_time + MAX_REQUEST, end_time)
+        end_time = start_time + MAX_REQUEST
+
+    day = timestamp(job["date"], 0)
+    if day + end_time <= now:
+        refuse("past", start_time, end_time)
+        return None, sorted(refused)
+
+    # Each 2 hour session opens 3 weeks before it starts, later sessions open later
+    latest_start = now + HORIZON.total_seconds() - day
+    if start_time > latest_start:
+        refuse("horizon", start_time, end_time)
+        return None, sorted(refused)
+    session_start = start_time
+    while session_start + mrbs.MAX_SESSION < end_time:
+        session_start += mrbs.MAX_SESSION
+        if session_start > latest_start:
+            refuse("horizon", session_start, end_time)
+            end_time = session_start
+            break
+
+    return dict(job, start_time=start_time, end_time=end_time), sorted(refused)
+
+
+def sessions(job, record=True):
+    """Split a job into one job per 2 hour session, each enters the booking window on its own
+
+    Returns (sessions, refused) like validate, with every rule but the horizon
+    applied: each session is checked against that when it is booked.
+    """
+    # As of the job's own start the horizon cuts nothing off
+    checked, refused = validate(job, now=timestamp(job["date"], job["start_time"]), record=record)
+    if checked is None:
+        return [], refused
+    return [dict(checked, start_time=start, end_time=min(start + mrbs.MAX_SESSION, checked["end_time"]))
+            for start in range(checked["start_time"], checked["end_time"], mrbs.MAX_SESSION)], refused
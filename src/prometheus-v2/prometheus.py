@@ -1,13 +1,23 @@
+import time
+LAUNCHED = time.perf_counter()  # For the launch-to-first-booking time
 import tkinter as tk
 from tkinter import ttk, messagebox
 import json
 import os
-from datetime import datetime, timedelta
-import config
-from chronos import initialize_driver, login, book_room
+import queue
+import sys
+import threading
+from datetime import datetime
+import config_store
+from catalog import get_catalog
+import mrbs
+import policy
+# Selenium (chronos, driver_pool, engine) is imported on the pre-warm thread, after the window is up
 from tkinter import filedialog
 import json
 
+LEASE_TIMEOUT = 300  # Seconds a booking waits for a logged-in browser, long enough for a Duo push
+
 class PrometheusGUI:
     def __init__(self, root):
         self.root = root
@@ -17,7 +27,8 @@ class PrometheusGUI:
         self.root.grid_rowconfigure(0, weight=1)
         self.root.grid_columnconfigure(0, weight=1)
         
-        self.driver = None  # Initialize driver as None
+        # Room catalog with its indexes, built once
+        self.catalog = get_catalog()
         
         # Initialize default configuration
         self.config_data = {
@@ -53,6 +64,21 @@ class PrometheusGUI:
         self.load_config_button = ttk.Button(self.config_frame, text="Load Config", command=self.load_config_file)
         self.load_config_button.grid(row=0, column=1, padx=5)
         
+        # Booking runs on a worker thread, which reports back through self.events
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        # One cancel event per job, Cancel sets every job's that has not finished yet
+        self.cancel_events = set()
+        self.cancel_lock = threading.Lock()
+        self.booked_count = 0
+        self.worker = threading.Thread(target=self.booking_worker, daemon=True)
+        self.worker.start()
+        self.root.after(100, self.poll_events)
+        self.first_booking = None
+        
+        # Start Chrome and log in while the form is being filled in
+        self.root.after_idle(self.start_prewarm)
+        
         # Load existing config after creating form elements
         self.load_config()
         
@@ -69,63 +95,56 @@ class PrometheusGUI:
         self.root.geometry(f'+{x}+{y}')
 
     def load_config(self):
-        """Load configuration from config.py"""
+        """Load configuration from the settings store"""
         try:
-            if os.path.exists('config.py'):
-                import importlib
-                importlib.reload(config)  # Reload config module
+            settings = config_store.load()
+            # Update GUI elements with loaded configuration
+            if settings:
+                # Convert seconds since midnight to HH:MM format
+                start_seconds = settings["start_time"]
+                end_seconds = settings["end_time"]
+                
+                start_time = policy.format_seconds(start_seconds)
+                end_time = policy.format_seconds(end_seconds)
+                
+                # Update self.config_data with loaded configuration
+                self.config_data.update({
+                    "area": settings["area"],
+                    "room": settings["room"],
+                    "date": settings["date"],
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "room_title": settings.get("room_title", ""),
+                    "room_description": settings.get("room_description", ""),
+                    "phone_number": settings.get("phone_number", ""),
+                    "email": settings.get("email", "")
+                })
+                
+                # Find area and room names from their IDs
+                self.area_var.set(self.catalog.area_name(settings["area"]))
+                self.update_rooms()
+                
+                room = self.catalog.room(settings["room"])
+                self.room_var.set(room.label if room else "")
+                
+                self.date_entry.delete(0, tk.END)
+                self.date_entry.insert(0, settings.get("date", ""))
+                self.start_time_var.set(start_time)
+                self.update_end_times()  # Update end time options
+                self.end_time_var.set(end_time)
+                self.title_entry.delete(0, tk.END)
+                self.title_entry.insert(0, settings.get("room_title", ""))
+                self.desc_entry.delete(0, tk.END)
+                self.desc_entry.insert(0, settings.get("room_description", ""))
+                self.phone_entry.delete(0, tk.END)
+                self.phone_entry.insert(0, settings.get("phone_number", ""))
+                self.email_entry.delete(0, tk.END)
+                self.email_entry.insert(0, settings.get("email", ""))
+                
+                self.status_label.config(text="Configuration loaded successfully!")
+            else:
+                messagebox.showinfo("Info", "No configuration data found in file.")
                 
-                # Update GUI elements with loaded configuration
-                if hasattr(config, 'config'):
-                    # Convert seconds since midnight to HH:MM format
-                    start_seconds = config.config["start_time"]
-                    end_seconds = config.config["end_time"]
-                    
-                    start_time = f"{start_seconds // 3600:02d}:{(start_seconds % 3600) // 60:02d}"
-                    end_time = f"{end_seconds // 3600:02d}:{(end_seconds % 3600) // 60:02d}"
-                    
-                    # Update self.config_data with loaded configuration
-                    self.config_data.update({
-                        "area": config.config["area"],
-                        "room": config.config["room"],
-                        "date": config.config["date"],
-                        "start_time": start_time,
-                        "end_time": end_time,
-                        "room_title": config.config.get("room_title", ""),
-                        "room_description": config.config.get("room_description", ""),
-                        "phone_number": config.config.get("phone_number", ""),
-                        "email": config.config.get("email", "")
-                    })
-                    
-                    # Find area name from area ID
-                    area_name = next((k for k, v in config.area_map.items() 
-                                    if v == config.config["area"]), "")
-                    self.area_var.set(area_name)
-                    self.update_rooms()
-                    
-                    # Find room name from room ID
-                    room_name = next((k for k, v in config.rooms_map.items() 
-                                    if v == config.config["room"]), "")
-                    self.room_var.set(room_name)
-                    
-                    self.date_entry.delete(0, tk.END)
-                    self.date_entry.insert(0, config.config.get("date", ""))
-                    self.start_time_var.set(start_time)
-                    self.update_end_times()  # Update end time options
-                    self.end_time_var.set(end_time)
-                    self.title_entry.delete(0, tk.END)
-                    self.title_entry.insert(0, config.config.get("room_title", ""))
-                    self.desc_entry.delete(0, tk.END)
-                    self.desc_entry.insert(0, config.config.get("room_description", ""))
-                    self.phone_entry.delete(0, tk.END)
-                    self.phone_entry.insert(0, config.config.get("phone_number", ""))
-                    self.email_entry.delete(0, tk.END)
-                    self.email_entry.insert(0, config.config.get("email", ""))
-                    
-                    self.status_label.config(text="Configuration loaded successfully!")
-                else:
-                    messagebox.showinfo("Info", "No configuration data found in file.")
-                    
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load configuration: {str(e)}")
     
@@ -134,7 +153,7 @@ class PrometheusGUI:
         ttk.Label(self.main_frame, text="Building:").grid(row=0, column=0, sticky=tk.W)
         self.area_var = tk.StringVar()
         self.area_combo = ttk.Combobox(self.main_frame, textvariable=self.area_var, state="readonly")
-        self.area_combo['values'] = list(config.area_map.keys())
+        self.area_combo['values'] = list(self.catalog.area_map.keys())
         self.area_combo.grid(row=0, column=1, sticky=(tk.W, tk.E))
         self.area_combo.bind('<<ComboboxSelected>>', self.update_rooms)
         
@@ -177,12 +196,12 @@ class PrometheusGUI:
         
         ttk.Label(self.main_frame, text="Description:").grid(row=6, column=0, sticky=tk.W)
         self.desc_entry = ttk.Entry(self.main_frame, state="disabled")
-        self.desc_entry.insert(0, config.config.get("room_description", "prometheus v2 by https://rinm.dev"))
+        self.desc_entry.insert(0, config_store.load().get("room_description", "prometheus v2 by https://rinm.dev"))
         self.desc_entry.grid(row=6, column=1, sticky=(tk.W, tk.E))
         
         ttk.Label(self.main_frame, text="Phone:").grid(row=7, column=0, sticky=tk.W)
         self.phone_entry = ttk.Entry(self.main_frame, state="disabled")
-        self.phone_entry.insert(0, config.config.get("phone_number", "000-000-0000"))
+        self.phone_entry.insert(0, config_store.load().get("phone_number", "000-000-0000"))
         self.phone_entry.grid(row=7, column=1, sticky=(tk.W, tk.E))
         
         ttk.Label(self.main_frame, text="Email (*):").grid(row=8, column=0, sticky=tk.W)
@@ -190,69 +209,45 @@ class PrometheusGUI:
         self.email_entry.insert(0, self.config_data["email"])
         self.email_entry.grid(row=8, column=1, sticky=(tk.W, tk.E))
         
-        # Book Button
-        self.book_button = ttk.Button(self.main_frame, text="Book Room", command=self.book_room)
-        self.book_button.grid(row=9, column=0, columnspan=2, pady=20)
+        # Book and Cancel Buttons
+        self.button_frame = ttk.Frame(self.main_frame)
+        self.button_frame.grid(row=9, column=0, columnspan=2, pady=20)
+        
+        self.book_button = ttk.Button(self.button_frame, text="Book Room", command=self.book_room)
+        self.book_button.grid(row=0, column=0, padx=5)
+        
+        self.cancel_button = ttk.Button(self.button_frame, text="Cancel", command=self.cancel_booking,
+                                        state="disabled")
+        self.cancel_button.grid(row=0, column=1, padx=5)
+        
+        # Try other rooms at the same time when a session is already taken
+        self.fallback_var = tk.BooleanVar(value=False)
+        self.fallback_check = ttk.Checkbutton(self.button_frame, text="Try other rooms",
+                                              variable=self.fallback_var)
+        self.fallback_check.grid(row=0, column=2, padx=5)
         
         # Status Label
         self.status_label = ttk.Label(self.main_frame, text="")
         self.status_label.grid(row=10, column=0, columnspan=2)
+        
+        # Live progress of the running booking
+        self.progress_list = tk.Listbox(self.main_frame, height=6)
+        self.progress_list.grid(row=12, column=0, columnspan=2, sticky=(tk.W, tk.E))
     
     def generate_time_slots(self):
         """Generate time slots based on selected area"""
-        start_slots = []
-        selected_area = self.area_var.get()
-        
-        # Set time restrictions based on area
-        if selected_area and ("EME:" in selected_area):  # Check for any EME area
-            start_time = "07:00"  # 7 AM
-            end_time = "20:00"    # 8 PM
-        elif selected_area and selected_area == "Library":
-            start_time = "07:00"  # 7 AM
-            end_time = "21:30"    # 9:30 PM
-        else:
-            start_time = "06:00"  # 6 AM default
-            end_time = "23:30"    # 11:30 PM default
-        
-        # Convert to datetime objects
-        current = datetime.strptime(start_time, "%H:%M")
-        end = datetime.strptime(end_time, "%H:%M")
-        
-        # Generate all possible start time slots
-        while current <= end:
-            start_slots.append(current.strftime("%H:%M"))
-            current += timedelta(minutes=30)
-        
-        return start_slots, []  # Return empty list for end_slots as they're now dynamic
-
+        # Start times come from the area's precomputed slot table in policy.py
+        return policy.start_slots(self.area_var.get()), []  # End slots depend on the start time
+    
     def update_end_times(self, event=None):
         """Update end time options based on selected start time and area"""
         selected_start = self.start_time_var.get()
-        selected_area = self.area_var.get()
         
         if not selected_start:
             return
-            
-        # Convert start time to datetime for calculations
-        start_time = datetime.strptime(selected_start, "%H:%M")
-        
-        # Set end time limits based on area
-        if selected_area and ("EME:" in selected_area):  # Check for any EME area
-            end_limit = datetime.strptime("20:30", "%H:%M")  # 8:30 PM
-        elif selected_area and selected_area == "Library":
-            end_limit = datetime.strptime("22:00", "%H:%M")  # 10:00 PM
-        else:
-            end_limit = datetime.strptime("00:30", "%H:%M") + timedelta(days=1)
-        
-        # Calculate end times (up to 6 hours from start time)
-        end_slots = []
-        current = start_time + timedelta(minutes=30)  # First slot is 30 mins after start
-        max_end = min(start_time + timedelta(hours=6), end_limit)  # Use the earlier of 6 hours or area limit
         
-        # Generate valid end time slots
-        while current <= max_end:
-            end_slots.append(current.strftime("%H:%M"))
-            current += timedelta(minutes=30)
+        # Up to 6 hours after the start, cut off at the area's closing time
+        end_slots = policy.end_slots(self.area_var.get(), selected_start)
         
         # Update end time dropdown
         self.end_time_combo['values'] = end_slots
@@ -266,27 +261,13 @@ class PrometheusGUI:
         # Clear current room selection
         self.room_var.set('')
         
+        # Opening hours differ per area
+        start_slots, _ = self.generate_time_slots()
+        self.start_time_combo['values'] = start_slots
+        
         if selected_area:
-            area_id = config.area_map[selected_area]
-            
-            # Define special cases for EME Tower 2 rooms
-            eme_tower2_special = ["EME 1252", "EME 1254"]
-            
-            # Filter rooms for selected area
-            if selected_area == "EME: Tower 2":
-                # Include both EME 2 rooms and special EME 1 rooms that belong to Tower 2
-                area_rooms = [room for room in config.rooms_map.keys() 
-                             if (room.startswith("EME 2") or 
-                                 any(room.startswith(special) for special in eme_tower2_special))]
-            elif selected_area == "EME: Tower 1":
-                # Exclude the special EME 1 rooms that belong to Tower 2
-                area_rooms = [room for room in config.rooms_map.keys() 
-                             if (room.startswith("EME 1") and 
-                                 not any(room.startswith(special) for special in eme_tower2_special))]
-            else:
-                # Handle other areas normally
-                area_rooms = [room for room in config.rooms_map.keys() 
-                             if room.startswith(self.get_area_prefix(selected_area))]
+            # Rooms for the area come straight from the catalog's area index
+            area_rooms = [room.label for room in self.catalog.query(area=selected_area)]
             
             self.room_combo['values'] = area_rooms
             
@@ -297,18 +278,6 @@ class PrometheusGUI:
             # Clear room options if no area is selected
             self.room_combo['values'] = []
     
-    def get_area_prefix(self, area_name):
-        """Get room prefix based on area name"""
-        prefixes = {
-            "Library": "LIB",
-            "Commons: Floor 0": "COM 0",
-            "Commons: Floor 1": "COM 1",
-            "Commons: Floor 3": "COM 3",
-            "EME: Tower 1": "EME 1",
-            "EME: Tower 2": "EME 2"
-        }
-        return prefixes.get(area_name, "")
-    
     def time_to_seconds(self, time_str):
         """Convert HH:MM time to seconds since midnight"""
         try:
@@ -316,6 +285,12 @@ class PrometheusGUI:
             return hours * 3600 + minutes * 60
         except (ValueError, TypeError, AttributeError):
             return 0  # Return 0 seconds as fallback
+
+    def end_time_to_seconds(self):
+        """Selected end time in seconds, one past midnight (Commons closes at 00:30) counts into the next day"""
+        start_seconds = self.time_to_seconds(self.start_time_var.get())
+        end_seconds = self.time_to_seconds(self.end_time_var.get())
+        return end_seconds + 86400 if end_seconds <= start_seconds else end_seconds
     
     def book_room(self):
         """Handle room booking"""
@@ -332,55 +307,179 @@ class PrometheusGUI:
             # Save configuration first
             self.save_config()
             
-            if self.driver is None:
-                self.driver = initialize_driver()
-                login(self.driver)
-
-            # Update config with form data
-            config.config.update({
-                "area": config.area_map[self.area_var.get()],
-                "room": config.rooms_map[self.room_var.get()],
+            # Snapshot the form, the worker thread must not touch Tk widgets
+            room_data = {
+                "area": self.catalog.area_map[self.area_var.get()],
+                "room": self.catalog.room_by_label(self.room_var.get()).id,
                 "start_time": self.time_to_seconds(self.start_time_var.get()),
-                "end_time": self.time_to_seconds(self.end_time_var.get()),
+                "end_time": self.end_time_to_seconds(),
                 "date": self.date_entry.get(),
                 "room_title": self.title_entry.get(),
                 "room_description": "prometheus v2 by https://rinm.dev",  # Default description
                 "phone_number": "000-000-0000",  # Default phone
                 "email": self.email_entry.get()
-            })
-            
-            # Call the booking function with the driver
-            book_room(self.driver)
+            }
             
-            self.status_label.config(text="Room booked and configuration saved successfully!")
+            cancel = threading.Event()
+            with self.cancel_lock:
+                self.cancel_events.add(cancel)
+            self.jobs.put((room_data, self.fallback_var.get(), cancel))
+            self.cancel_button.config(state="normal")
+            waiting = self.jobs.qsize()
+            self.status_label.config(text=f"Booking queued ({waiting} waiting)")
             
         except Exception as e:
             messagebox.showerror("Error", f"Booking failed: {str(e)}")
             self.status_label.config(text="Booking failed!")
     
+    def cancel_booking(self):
+        """Stop the running booking and drop the queued ones"""
+        # Queued jobs stay in the queue, the worker skips them once their event is set
+        with self.cancel_lock:
+            for cancel in self.cancel_events:
+                cancel.set()
+        self.status_label.config(text="Cancelling...")
+    
+    def start_prewarm(self):
+        """Called once the window is up, starts the driver pool on a background thread"""
+        print(f"Window ready after {time.perf_counter() - LAUNCHED:.2f}s")
+        self.status_label.config(text="Starting browser and logging in, check your phone if Duo asks...")
+        threading.Thread(target=self.prewarm, daemon=True).start()
+    
+    def prewarm(self):
+        """Import Selenium and warm up a logged-in driver, off the Tk thread"""
+        try:
+            from driver_pool import get_pool
+            get_pool().wait_ready()
+            print(f"Browser ready and logged in after {time.perf_counter() - LAUNCHED:.2f}s")
+            self.events.put(("ready", None))
+        except Exception as e:
+            print(f"Could not pre-warm the browser: {e}")
+            self.events.put(("browser_error", str(e)))
+    
+    def booking_worker(self):
+        """Run queued bookings one after another, off the Tk thread"""
+        while True:
+            room_data, fallback, cancel = self.jobs.get()
+            booked = 0
+            # Posted once the job is out of cancel_events, so the GUI sees whether anything is left to cancel
+            outcome = ("cancelled", None)
+            try:
+                if cancel.is_set():
+                    # Cancelled while it was still queued
+                    continue
+                from chronos import book_room
+                from driver_pool import get_pool
+                from engine import FALLBACK_ROOMS
+                self.events.put(("start", None))
+                self.events.put(("status", "Logging in, check your phone if Duo asks..."))
+                # Borrow a health-checked driver from the pool for this booking
+                with get_pool().lease(LEASE_TIMEOUT) as driver:
+                    self.events.put(("status", "Logged in, booking..."))
+                    results = book_room(driver, room_data=room_data,
+                                        on_result=lambda result: self.events.put(("slot", result)),
+                                        cancel=cancel,
+                                        fallback=FALLBACK_ROOMS if fallback else 0)
+                if results is False:
+                    raise Exception("see the console for details")
+                booked = sum(1 for result in results if result["status"] == mrbs.BOOKED)
+                outcome = ("done", booked)
+            except Exception as e:
+                outcome = ("error", str(e))
+            finally:
+                with self.cancel_lock:
+                    self.cancel_events.discard(cancel)
+                self.events.put(outcome)
+    
+    def poll_events(self):
+        """Apply progress events from the worker, called on the Tk thread via root.after"""
+        try:
+            while True:
+                kind, payload = self.events.get_nowait()
+                if kind == "start":
+                    self.booked_count = 0
+                elif kind == "status":
+                    self.status_label.config(text=payload)
+                elif kind == "ready":
+                    # Only if no booking has taken over the status line yet
+                    if self.status_label.cget("text").startswith("Starting browser"):
+                        self.status_label.config(text="Browser ready, logged in")
+                elif kind == "slot":
+                    self.progress_list.insert(tk.END, self.describe_slot(payload))
+                    self.progress_list.see(tk.END)
+                    if payload["status"] == mrbs.BOOKED:
+                        self.booked_count += 1
+                        if self.first_booking is None:
+                            self.first_booking = time.perf_counter() - LAUNCHED
+                            print(f"Launch to first booking: {self.first_booking:.2f}s")
+                    self.status_label.config(
+                        text=f"Booking... {self.booked_count}/{mrbs.MAX_BOOKINGS} bookings used")
+                elif kind == "done":
+                    saved = sum(policy.rejections().values())
+                    self.status_label.config(text=f"Done, {payload} room(s) booked and configuration saved! "
+                                                  f"({saved} session(s) refused without contacting the site)")
+                elif kind == "error":
+                    messagebox.showerror("Error", f"Booking failed: {payload}")
+                    self.status_label.config(text="Booking failed!")
+                elif kind == "browser_error":
+                    # Bookings still try to start a browser, this only reports the failed warm-up
+                    messagebox.showerror("Error", payload)
+                    if self.status_label.cget("text").startswith("Starting browser"):
+                        self.status_label.config(text="Browser could not start, see the console")
+                elif kind == "cancelled":
+                    self.status_label.config(text="Booking cancelled")
+                if kind in ("done", "error", "cancelled"):
+                    # The worker may already be running the next job, jobs is empty by then
+                    with self.cancel_lock:
+                        idle = not self.cancel_events
+                    if idle:
+                        self.cancel_button.config(state="disabled")
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+    
+    def describe_slot(self, result):
+        """One line summary of a per-slot result for the progress list"""
+        times = f"{policy.format_seconds(result['start_time'])}-{policy.format_seconds(result['end_time'])}"
+        if result["status"] == mrbs.BOOKED and result["room"] != result["requested_room"]:
+            room = self.catalog.room(result["room"])
+            return f"{times} booked in {room.name if room else result['room']} instead"
+        if result["status"] == mrbs.BOOKED:
+            return f"{times} booked"
+        if result["status"] == mrbs.ERROR:
+            return f"{times} error: {result['error']}"
+        if result["status"] == mrbs.LIMIT:
+            return f"{times} booking limit reached"
+        if result["status"] == mrbs.CANCELLED:
+            return f"{times} cancelled"
+        if result["status"] == mrbs.FREE:
+            return f"{times} free, not submitted"
+        if result["status"] == mrbs.REJECTED:
+            return f"{times} not sent: {result['policy']}"
+        if result["status"] == mrbs.HELD:
+            return f"{times} already yours"
+        if result["status"] == mrbs.TOO_EARLY:
+            return f"{times} not open for booking yet"
+        return f"{times} conflict: {result['conflict'] or result['policy']}"
+    
     def save_config(self):
-        """Save current configuration to config.py"""
+        """Save current configuration to the settings store"""
         try:
             config_data = {
-                "area": config.area_map[self.area_var.get()],
-                "room": config.rooms_map[self.room_var.get()],
+                "area": self.catalog.area_map[self.area_var.get()],
+                "room": self.catalog.room_by_label(self.room_var.get()).id,
                 "date": self.date_entry.get(),
                 "start_time": self.time_to_seconds(self.start_time_var.get()),
-                "end_time": self.time_to_seconds(self.end_time_var.get()),
+                "end_time": self.end_time_to_seconds(),
                 "room_title": self.title_entry.get(),
                 "room_description": self.desc_entry.get(),
                 "phone_number": self.phone_entry.get(),
                 "email": self.email_entry.get()
             }
             
-            # Write to config.py
-            with open('config.py', 'w') as f:
-                f.write("config = " + json.dumps(config_data, indent=4))
-                f.write("\n\n# Room mappings\n")
-                f.write("rooms_map = " + json.dumps(config.rooms_map, indent=4))
-                f.write("\n\n# Area mappings\n")
-                f.write("area_map = " + json.dumps(config.area_map, indent=4))
-                
+            # Atomic write to settings.json, the room catalog in config.py is never rewritten
+            config_store.update(**config_data)
+            
             self.status_label.config(text="Configuration saved successfully!")
             
         except Exception as e:
@@ -452,9 +551,9 @@ def main():
     app = PrometheusGUI(root)
     root.mainloop()
     
-    # Clean up
-    if app.driver:
-        app.driver.quit()
+    # Clean up, the pool only exists if Selenium was ever loaded
+    if "driver_pool" in sys.modules:
+        sys.modules["driver_pool"].close_pool()
 
 def display_prometheus_banner():
     banner = r"""
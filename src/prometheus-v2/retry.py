@@ -0,0 +1,25 @@
+"""Which booking failures are worth retrying, and how long to wait between attempts"""
+import random
+import requests
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+
+BUDGET = 60           # Seconds a job may spend waiting on retries in total
+MAX_ATTEMPTS = 4      # Tries per 2 hour session, the first one included
+BASE_DELAY = 0.5
+MAX_DELAY = 8
+EARLY_DELAY = 0.5     # Seconds between tries of a slot the site says is not open yet
+
+
+def is_transient(error):
+    """Timeouts, dropped connections, stale elements and 5xx answers may well work a second time"""
+    if isinstance(error, (requests.Timeout, requests.ConnectionError,
+                          TimeoutException, StaleElementReferenceException)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return False
+
+
+def backoff(attempt):
+    """Exponential backoff with full jitter, so parallel workers do not retry in lockstep"""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
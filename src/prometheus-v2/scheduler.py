@@ -0,0 +1,191 @@
+"""Earliest-deadline-first scheduler for booking jobs on a bounded pool of worker threads"""
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+import tracing
+from jobqueue import QUEUED, RUNNING, DONE, FAILED, EXPIRED
+from tracing import percentile
+
+CAPACITY = 16      # Jobs ready to start before submit blocks, ones waiting for their window do not count
+SAMPLES = 1000     # Latest queue wait times kept for the report
+
+
+class Scheduler:
+    """Runs runner(job) for every submitted job, earliest deadline first
+
+    A job is not started before its earliest time (when its booking window
+    opens), ties on the deadline go to the higher priority, then to the oldest.
+    A job whose deadline passes while it waits is dropped without running.
+    Every submit returns an item dict that is updated as the job moves along,
+    its "done" event is set once it finished, failed or expired. pause() holds
+    every job back until resume(), for swapping out what the runner uses.
+    """
+
+    def __init__(self, runner, workers=2, capacity=CAPACITY, on_done=None):
+        self.runner = runner
+        self.capacity = capacity
+        self.on_done = on_done
+        self.condition = threading.Condition()
+        self.waiting = []   # (earliest, seq, item), not open yet
+        self.ready = []     # (deadline, -priority, seq, item)
+        self.sequence = itertools.count()
+        self.running = 0
+        self.unfinished = 0   # Submitted and not finished yet, on_done included
+        self.closed = False
+        self.paused = False
+        self.counts = {DONE: 0, FAILED: 0, EXPIRED: 0, "on_time": 0}
+        self.waits = deque(maxlen=SAMPLES)
+        self.threads = [threading.Thread(target=self.work, name=f"scheduler-{i}", daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def full(self):
+        with self.condition:
+            return len(self.ready) >= self.capacity
+
+    def busy(self):
+        """Whether any job is running right now"""
+        with self.condition:
+            return self.running > 0
+
+    def pause(self):
+        """Stop starting jobs and wait until none is running, jobs can still be submitted"""
+        with self.condition:
+            self.paused = True
+            self.condition.wait_for(lambda: self.running == 0)
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+    def submit(self, job, priority=0, earliest=None, deadline=None, block=True, timeout=None):
+        """Queue a job, blocking while the scheduler is full unless block is False
+
+        Raises queue.Full when there is no room (after timeout seconds if blocking).
+        """
+        now = time.time()
+        item = {"job": job, "priority": priority, "earliest": earliest, "deadline": deadline,
+                "status": QUEUED, "submitted_at": now, "started_at": None, "finished_at": None,
+                "result": None, "error": None, "done": threading.Event()}
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.ready) < self.capacity or self.closed,
+                                           timeout if block else 0):
+                raise queue.Full
+            if self.closed:
+                raise RuntimeError("Scheduler is closed")
+            seq = next(self.sequence)
+            self.unfinished += 1
+            if earliest is not None and earliest > now:
+                heapq.heappush(self.waiting, (earliest, seq, item))
+            else:
+                self.push_ready(seq, item)
+            self.condition.notify_all()
+        return item
+
+    def push_ready(self, seq, item):
+        deadline = item["deadline"] if item["deadline"] is not None else float("inf")
+        heapq.heappush(self.ready, (deadline, -item["priority"], seq, item))
+
+    def next_item(self):
+        """Block until a job may start and return it, None once closed and drained"""
+        with self.condition:
+            while True:
+                if self.paused and not self.closed:
+                    self.condition.wait()
+                    continue
+                now = time.time()
+                while self.waiting and self.waiting[0][0] <= now:
+                    _, seq, item = heapq.heappop(self.waiting)
+                    self.push_ready(seq, item)
+
+                if self.ready:
+                    item = heapq.heappop(self.ready)[-1]
+                    self.condition.notify_all()   # Room for a blocked submit
+                    if item["deadline"] is not None and item["deadline"] <= now:
+                        item["status"] = EXPIRED
+                        return item
+                    item["status"] = RUNNING
+                    item["started_at"] = now
+                    self.running += 1
+                    return item
+
+                if self.closed and not self.waiting:
+                    return None
+                # Sleep until the next window opens or something is submitted
+                self.condition.wait(self.waiting[0][0] - now if self.waiting else None)
+
+    def work(self):
+        while True:
+            item = self.next_item()
+            if item is None:
+                return
+            if item["status"] == RUNNING:
+                try:
+                    item["result"] = self.runner(item["job"])
+                    item["status"] = DONE
+                except Exception as e:
+                    item["error"] = str(e)
+                    item["status"] = FAILED
+            self.finish(item)
+
+    def finish(self, item):
+        item["finished_at"] = time.time()
+        on_time = item["status"] == DONE and (item["deadline"] is None or item["finished_at"] <= item["deadline"])
+        # Queue wait counts from when the job could first have started
+        wait = None
+        if item["started_at"] is not None:
+            wait = item["started_at"] - max(item["submitted_at"], item["earliest"] or 0)
+        with self.condition:
+            if item["started_at"] is not None:
+                self.running -= 1
+            self.counts[item["status"]] += 1
+            self.counts["on_time"] += on_time
+            if wait is not None:
+                self.waits.append(wait)
+        tracing.write({"event": "scheduler.job", "status": item["status"], "priority": item["priority"],
+                       "wait_ms": wait * 1000 if wait is not None else None, "on_time": on_time})
+        if self.on_done is not None:
+            self.on_done(item)
+        item["done"].set()
+        with self.condition:
+            self.unfinished -= 1
+            self.condition.notify_all()
+
+    def join(self):
+        """Wait until every submitted job has finished or expired"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.unfinished == 0)
+
+    def close(self, drain=False):
+        """Stop the workers, returns the jobs that never started unless drain runs them first"""
+        with self.condition:
+            self.paused = False
+            if drain:
+                self.condition.wait_for(lambda: self.unfinished == 0)
+            dropped = [entry[-1] for entry in self.waiting + self.ready]
+            self.waiting, self.ready = [], []
+            self.unfinished -= len(dropped)
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        return dropped
+
+    def report(self):
+        """Print how many jobs finished on time and how long they queued"""
+        with self.condition:
+            counts = dict(self.counts)
+            waits = sorted(self.waits)
+        finished = counts[DONE] + counts[FAILED] + counts[EXPIRED]
+        if not finished:
+            return
+        print(f"{finished} job(s): {counts[DONE]} done ({counts['on_time']} on time), "
+              f"{counts[FAILED]} failed, {counts[EXPIRED]} dropped past their deadline")
+        if waits:
+            print(f"Queue wait p50 {percentile(waits, 50):.1f}s, p95 {percentile(waits, 95):.1f}s, "
+                  f"max {waits[-1]:.1f}s")
@@ -0,0 +1,102 @@
+"""Keep the authenticated CWL session on disk so login() only runs when it has expired"""
+import json
+import os
+import time
+from urllib.parse import urlparse
+import mrbs
+import http_engine
+
+SESSION_FILE = "session.json"
+SESSION_TTL = 8 * 3600    # Seconds a saved session is trusted before it is thrown away
+PROBE_TIMEOUT = 5
+
+# Set to a folder (e.g. "chrome-profile") to reuse one Chrome profile between launches,
+# this keeps the browser's asset cache warm as well as the cookies
+PROFILE_DIR = None
+
+
+def booking_host():
+    return urlparse(mrbs.BASE_URL).hostname
+
+
+def save_session(driver, path=SESSION_FILE):
+    """Save the driver's cookies for the booking site with an expiry"""
+    save_cookies(driver.get_cookies(), driver.execute_script("return navigator.userAgent"), path)
+
+
+def save_cookies(cookies, user_agent=None, path=SESSION_FILE):
+    """Save Selenium-style cookies for the booking site with an expiry"""
+    host = booking_host()
+    cookies = [c for c in cookies if host.endswith(c.get("domain", "").lstrip("."))]
+    now = time.time()
+    expires_at = now + SESSION_TTL
+    # Never trust the file longer than the cookies themselves
+    for cookie in cookies:
+        if "expiry" in cookie:
+            expires_at = min(expires_at, cookie["expiry"])
+
+    state = {
+        "saved_at": now,
+        "expires_at": expires_at,
+        "user_agent": user_agent,
+        "cookies": cookies,
+    }
+
+    # Write to a private temp file first so a crash never leaves half a session behind
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+    return state
+
+
+def load_session(path=SESSION_FILE):
+    """Return the saved session, or None if there is none or it has expired"""
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if state.get("expires_at", 0) <= time.time():
+        clear_session(path)
+        return None
+    return state
+
+
+def clear_session(path=SESSION_FILE):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def probe_session(state, session=None):
+    """Cheap validity check, True if the studyrooms page no longer offers a login
+
+    Pass a long-lived session to probe (and keep alive) that one instead.
+    """
+    probe = session or http_engine.create_session(state["cookies"], state.get("user_agent"), pool_size=1)
+    try:
+        response = probe.get(mrbs.BASE_URL, timeout=PROBE_TIMEOUT)
+        return response.ok and 'value="Log in"' not in response.text
+    except Exception:
+        return False
+    finally:
+        if session is None:
+            probe.close()
+
+
+def restore_session(driver, state):
+    """Put the saved cookies back into a fresh driver"""
+    # Cookies can only be added for the domain the browser is currently on
+    driver.get(mrbs.BASE_URL)
+    for cookie in state["cookies"]:
+        cookie = {k: v for k, v in cookie.items() if k in
+                  ("name", "value", "domain", "path", "expiry", "secure", "httpOnly", "sameSite")}
+        try:
+            driver.add_cookie(cookie)
+        except Exception:
+            pass
+    driver.refresh()
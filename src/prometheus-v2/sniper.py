@@ -0,0 +1,135 @@
+"""Release-time sniping: pre-fill the booking forms and submit the moment a slot enters the window"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import mrbs
+import http_engine
+from policy import SERVER_TZ, HORIZON
+
+SPIN = 0.05                    # Busy-wait the last 50ms instead of trusting sleep()
+
+
+def estimate_clock(session, samples=8):
+    """Estimate the server clock offset and round-trip time from HTTP Date headers
+
+    Date only has one second resolution, but every sample bounds the offset to
+    [date - t1, date + 1 - t0]. Staggering the samples across a second and
+    intersecting the bounds narrows that down well below one second.
+    """
+    low, high = float("-inf"), float("inf")
+    rtts = []
+    for i in range(samples):
+        t0 = time.time()
+        response = session.head(mrbs.BASE_URL, timeout=http_engine.TIMEOUT)
+        t1 = time.time()
+        server = parsedate_to_datetime(response.headers["Date"]).timestamp()
+
+        rtts.append(t1 - t0)
+        low = max(low, server - t1)
+        high = min(high, server + 1 - t0)
+        # Land the next request at a different fraction of a second
+        time.sleep(1 / samples)
+
+    if low > high:
+        # Bounds disagree (clock jumped or a proxy rewrote Date), fall back to the newest sample
+        low = high = server + 0.5 - (t0 + t1) / 2
+    return {"offset": (low + high) / 2, "error": (high - low) / 2, "rtt": min(rtts)}
+
+
+def release_time(date, start_time, horizon=HORIZON):
+    """Server timestamp at which a slot first falls inside the booking window"""
+    day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=SERVER_TZ)
+    return (day + timedelta(seconds=start_time) - horizon).timestamp()
+
+
+def prepare(session, room_data, start_time, end_time):
+    """Load and pre-fill the edit_entry.php form ahead of the window opening"""
+    action, fields = http_engine.fetch_form(session, mrbs.entry_url(room_data, start_time, end_time))
+    return action, http_engine.fill_form(fields, room_data)
+
+
+def wait_until(local_time):
+    """Sleep until local_time, spinning for the last few milliseconds"""
+    while True:
+        remaining = local_time - time.time()
+        if remaining <= 0:
+            return
+        if remaining > SPIN:
+            time.sleep(remaining - SPIN)
+
+
+def snipe(session, targets, at=None, lead=0.0, clock=None):
+    """Submit pre-filled forms for targets [(room_data, start, end), ...] at the release instant
+
+    at is the server timestamp to hit, by default each target fires at its own
+    release time. lead fires that many seconds earlier for tuning. Returns one
+    result per target with the achieved submit time against the target.
+    """
+    targets = targets[:mrbs.MAX_BOOKINGS]
+    clock = clock or estimate_clock(session)
+    print(f"Server clock offset {clock['offset'] * 1000:+.1f}ms "
+          f"(±{clock['error'] * 1000:.1f}ms), rtt {clock['rtt'] * 1000:.1f}ms")
+
+    forms = [prepare(session, *target) for target in targets]
+
+    def fire(target, form):
+        room_data, start_time, end_time = target
+        target_at = at if at is not None else release_time(room_data["date"], start_time)
+
+        # Send so the request arrives at the server as the window opens
+        fire_at = target_at - clock["offset"] - clock["rtt"] / 2 - lead
+        print(f"Form for {room_data['date']} {start_time}s ready, firing in {fire_at - time.time():.1f}s")
+        wait_until(fire_at)
+        sent = time.time()
+        try:
+            accepted = http_engine.submit_form(session, *form)
+            result = mrbs.slot_result(room_data, start_time, end_time,
+                                      mrbs.BOOKED if accepted else mrbs.ERROR,
+                                      error="" if accepted else "Booking was not accepted")
+        except Exception as e:
+            result = mrbs.slot_result(room_data, start_time, end_time, mrbs.ERROR, error=str(e))
+
+        # Estimated server time the request landed, against the target
+        arrived = sent + clock["offset"] + clock["rtt"] / 2
+        result.update({
+            "target": target_at,
+            "arrived": arrived,
+            "delta_ms": (arrived - target_at) * 1000,
+            "response_ms": (time.time() - sent) * 1000,
+        })
+        return result
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        results = list(executor.map(fire, targets, forms))
+
+    for result in results:
+        print(f"Room {result['room']} {result['status']}: "
+              f"{result['delta_ms']:+.1f}ms from target, response in {result['response_ms']:.0f}ms")
+    return results
+
+
+if __name__ == "__main__":
+    import config_store
+    import chronos
+
+    room_data = config_store.load()
+
+    driver = chronos.initialize_driver()
+    chronos.ensure_login(driver)
+    session = http_engine.session_from_driver(driver, pool_size=mrbs.MAX_BOOKINGS)
+
+    # One target per 2 hour session of the configured range
+    targets = []
+    start_time = room_data["start_time"]
+    while start_time < room_data["end_time"]:
+        session_end = min(start_time + mrbs.MAX_SESSION, room_data["end_time"])
+        targets.append((room_data, start_time, session_end))
+        start_time = session_end
+
+    at = release_time(room_data["date"], room_data["start_time"])
+    print(f"Window opens at {datetime.fromtimestamp(at, SERVER_TZ)}")
+    try:
+        snipe(session, targets)
+    finally:
+        driver.quit()
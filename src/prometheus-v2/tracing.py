@@ -0,0 +1,121 @@
+"""Per-phase timing spans written to an append-only JSONL trace, plus a report command"""
+import json
+import math
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_FILE = "trace.jsonl"
+ENABLED = True
+
+write_lock = threading.Lock()
+files = {}   # path -> line-buffered handle kept open for the whole process
+local = threading.local()
+
+
+def write(record, path=None):
+    if not ENABLED:
+        return
+    record["ts"] = time.time()
+    line = json.dumps(record) + "\n"
+    path = path or TRACE_FILE
+    with write_lock:
+        f = files.get(path)
+        if f is None:
+            f = files[path] = open(path, "a", buffering=1)
+        f.write(line)
+
+
+@contextmanager
+def span(name, **fields):
+    """Time one phase, tagged with the booking it belongs to"""
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        write({
+            "span": name,
+            "ms": (time.perf_counter() - start) * 1000,
+            "ok": ok,
+            "booking": getattr(local, "booking", None),
+            **fields,
+        })
+
+
+@contextmanager
+def booking(**fields):
+    """Trace one booking attempt as a whole and count its WebDriver round-trips"""
+    local.booking = uuid.uuid4().hex[:12]
+    local.roundtrips = 0
+    try:
+        with span("booking", **fields):
+            yield
+    finally:
+        write({"span": "roundtrips", "count": local.roundtrips, "booking": local.booking})
+        local.booking = None
+
+
+def instrument(driver):
+    """Count every WebDriver command the driver sends against the current booking"""
+    if getattr(driver, "_traced", False):
+        return driver
+    execute = driver.execute
+
+    def counted_execute(*args, **kwargs):
+        if getattr(local, "booking", None):
+            local.roundtrips += 1
+        return execute(*args, **kwargs)
+
+    driver.execute = counted_execute
+    driver._traced = True
+    return driver
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def report(path=TRACE_FILE):
+    """Print p50/p95/p99 per phase for a trace file"""
+    phases = {}
+    roundtrips = []
+    refused = {}
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("span") == "roundtrips":
+                roundtrips.append(record["count"])
+            elif record.get("event") == "policy.reject":
+                refused[record["reason"]] = refused.get(record["reason"], 0) + record["sessions"]
+            elif "ms" in record:
+                phases.setdefault(record["span"], []).append(record["ms"])
+
+    print(f"{'phase':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in sorted(phases):
+        values = sorted(phases[name])
+        print(f"{name:<22}{len(values):>7}"
+              f"{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}")
+
+    if roundtrips:
+        values = sorted(roundtrips)
+        print(f"\nWebDriver round-trips per booking: p50 {percentile(values, 50)}, "
+              f"p95 {percentile(values, 95)}, max {values[-1]}")
+
+    if refused:
+        print(f"\nSessions refused by the policy check without a round-trip: {sum(refused.values())} "
+              f"({', '.join(f'{reason} {n}' for reason, n in sorted(refused.items()))})")
+
+
+if __name__ == "__main__":
+    report(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE)
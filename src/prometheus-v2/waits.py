@@ -0,0 +1,139 @@
+"""Browser waits that learn from how long each wait site usually takes
+
+Every call site has a name ("selenium.check", "login.duo", ...) and a rolling
+window of its recent latencies. Polling starts fast and backs off, and once a
+site has enough samples its timeout is derived from the observed p99 instead
+of the fixed value. Timeouts are recorded too, at the time given up after, so
+a site that got slower earns a longer timeout instead of failing for good.
+The samples are kept in WAITS_FILE between runs.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from tracing import percentile
+
+# False goes back to the fixed timeouts and poll intervals every wait site passes in
+ADAPTIVE = True
+
+WAITS_FILE = "wait_stats.json"
+WINDOW = 200          # Latest samples kept per site
+MIN_SAMPLES = 10      # Below this a site uses its fixed timeout
+MARGIN = 2            # Learned timeout is this many times the p99
+MIN_TIMEOUT = 2       # Seconds, never time out quicker than this
+FIRST_POLL = 0.05     # Seconds before the second look
+POLL_GROWTH = 1.5
+SAVE_EVERY = 10       # Samples between writes of WAITS_FILE
+
+
+class WaitStats:
+    """Rolling latency samples per wait site, shared by every thread"""
+
+    def __init__(self, path=WAITS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.unsaved = 0
+        try:
+            with open(path) as f:
+                for name, values in json.load(f).items():
+                    self.samples[name] = deque(values, maxlen=WINDOW)
+        except (OSError, ValueError):
+            pass
+
+    def record(self, name, seconds):
+        """Add a sample, a wait that timed out is recorded at its timeout so the estimate can grow again"""
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=WINDOW)).append(round(seconds, 4))
+            self.unsaved += 1
+            if self.unsaved < SAVE_EVERY:
+                return
+            self.unsaved = 0
+            data = {name: list(values) for name, values in self.samples.items()}
+        self.save(data)
+
+    def save(self, data):
+        """Write the samples to a temp file and rename it over the old one, like config_store.save"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".wait_stats-", suffix=".tmp", dir=directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def timeout(self, name, fixed):
+        """Seconds to give a wait at this site, None (wait forever) stays None"""
+        if fixed is None or not ADAPTIVE:
+            return fixed
+        with self.lock:
+            values = sorted(self.samples.get(name, ()))
+        if len(values) < MIN_SAMPLES:
+            return fixed
+        # A hung page now fails fast, but never later than the fixed timeout would have
+        return min(fixed, max(MIN_TIMEOUT, percentile(values, 99) * MARGIN))
+
+    def summary(self):
+        """name -> (samples, p50, p99) in seconds"""
+        with self.lock:
+            items = [(name, sorted(values)) for name, values in self.samples.items()]
+        return {name: (len(values), percentile(values, 50), percentile(values, 99))
+                for name, values in sorted(items) if values}
+
+
+stats = None
+stats_lock = threading.Lock()
+
+
+def get_stats():
+    """Process wide WaitStats on WAITS_FILE"""
+    global stats
+    with stats_lock:
+        if stats is None:
+            stats = WaitStats()
+        return stats
+
+
+def until(driver, name, condition, fixed=10, poll=0.5, ignored=(NoSuchElementException,)):
+    """Poll condition(driver) until it returns something truthy, like WebDriverWait.until
+
+    fixed and poll are the timeout and poll interval the site used before, poll is
+    also where the adaptive backoff stops. fixed=None waits for as long as it takes.
+    """
+    site_stats = get_stats()
+    timeout = site_stats.timeout(name, fixed)
+    interval = FIRST_POLL if ADAPTIVE else poll
+    started = time.monotonic()
+    while True:
+        try:
+            value = condition(driver)
+            if value:
+                site_stats.record(name, time.monotonic() - started)
+                return value
+        except ignored:
+            pass
+
+        elapsed = time.monotonic() - started
+        if timeout is not None and elapsed >= timeout:
+            site_stats.record(name, elapsed)
+            raise TimeoutException(f"{name} did not finish within {timeout:.1f}s")
+        time.sleep(interval if timeout is None else min(interval, timeout - elapsed))
+        if ADAPTIVE:
+            interval = min(poll, interval * POLL_GROWTH)
+
+
+if __name__ == "__main__":
+    # The learned timeout applies once a site has MIN_SAMPLES, capped at the site's fixed timeout
+    print(f"{'wait site':<20}{'samples':>8}{'p50 ms':>9}{'p99 ms':>9}{'learned s':>11}")
+    for name, (count, p50, p99) in get_stats().summary().items():
+        print(f"{name:<20}{count:>8}{p50 * 1000:>9.0f}{p99 * 1000:>9.0f}{max(MIN_TIMEOUT, p99 * MARGIN):>11.1f}")
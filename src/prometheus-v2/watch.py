@@ -0,0 +1,221 @@
+"""Watch the day view for cancellations and book freed slots in the wanted rooms straight away
+
+    python watch.py 2025-03-24 --room 23 --room 24 --window 10:00-12:00
+"""
+import argparse
+import hashlib
+import time
+import mrbs
+import http_engine
+import tracing
+from availability import RESOLUTION, parse_day_view
+from catalog import get_catalog
+from policy import format_seconds
+
+MIN_INTERVAL = 5     # Seconds between polls right after a change
+MAX_INTERVAL = 120   # Seconds between polls after a long quiet spell
+BACKOFF = 1.5        # Interval growth per unchanged poll
+
+
+class DayViewWatcher:
+    """Fetches one (date, area) day view, cheaply telling whether it changed since last time
+
+    Sends If-None-Match / If-Modified-Since when the server gave validators, and
+    otherwise hashes the page so an unchanged one is never parsed again.
+    """
+
+    def __init__(self, session, date, area):
+        self.session = session
+        self.date = date
+        self.area = area
+        self.etag = None
+        self.last_modified = None
+        self.digest = None
+        self.grid = None
+
+    def poll(self):
+        """Return (old grid, new grid) when the page changed, None when it did not"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        with tracing.span("watch.poll", date=self.date, area=self.area):
+            response = self.session.get(mrbs.day_url(self.date, self.area), headers=headers,
+                                        timeout=http_engine.TIMEOUT)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+
+        digest = hashlib.sha1(response.content).hexdigest()
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        old, self.grid = self.grid, parse_day_view(response.text)
+        return old, self.grid
+
+
+def freed_slots(old, new):
+    """room -> slot starts that are free in new but were not in old, every free slot on the first poll"""
+    freed = {}
+    for room in new["rooms"]:
+        free = set(new["slots"]) - new["booked"].get(room, set())
+        if old is not None:
+            free -= set(old["slots"]) - old["booked"].get(room, set())
+        if free:
+            freed[room] = free
+    return freed
+
+
+def free_runs(grid, room, wanted):
+    """Contiguous runs of wanted slot starts that are free in room, as (start, end) seconds"""
+    booked = grid["booked"].get(room, set())
+    runs = []
+    for slot in sorted(wanted):
+        if slot in booked:
+            continue
+        if runs and runs[-1][1] == slot:
+            runs[-1] = (runs[-1][0], slot + RESOLUTION)
+        else:
+            runs.append((slot, slot + RESOLUTION))
+    return runs
+
+
+class Watch:
+    """Polls every (date, area) the targets need and books freed slots that match one
+
+    A target is {"rooms": [ids in order of preference], "date", "start_time", "end_time"},
+    it is done once its whole window is booked in any of its rooms.
+    """
+
+    def __init__(self, session, booking_engine, targets, room_data):
+        self.booking_engine = booking_engine
+        self.room_data = room_data
+        self.targets = [dict(target, held=self.already_held(target)) for target in targets]
+        self.interval = MIN_INTERVAL
+
+        catalog = get_catalog()
+        keys = {(target["date"], catalog.room(room).area_id)
+                for target in targets for room in target["rooms"] if catalog.room(room)}
+        self.watchers = [DayViewWatcher(session, date, area) for date, area in sorted(keys)]
+
+    def already_held(self, target):
+        """Slots of the target the ledger says one of its rooms is already booked for"""
+        ledger = self.booking_engine.ledger
+        if ledger is None:
+            return set()
+        return {slot for slot in range(target["start_time"], target["end_time"], RESOLUTION)
+                if any(ledger.holds(room, target["date"], slot, slot + RESOLUTION) for room in target["rooms"])}
+
+    def missing(self, target):
+        wanted = range(target["start_time"], target["end_time"], RESOLUTION)
+        return [slot for slot in wanted if slot not in target["held"]]
+
+    def done(self):
+        return all(not self.missing(target) for target in self.targets)
+
+    def react(self, watcher, old, new, detected):
+        """Book every target slot freed in this grid, returns True if anything was tried"""
+        freed = freed_slots(old, new)
+        tried = False
+        for target in self.targets:
+            if target["date"] != watcher.date:
+                continue
+            for room in target["rooms"]:
+                missing = self.missing(target)
+                if room not in new["booked"] or not freed.get(room, set()) & set(missing):
+                    continue
+                for start_time, end_time in free_runs(new, room, missing):
+                    tried = True
+                    self.book(target, room, watcher.area, start_time, end_time, detected)
+        return tried
+
+    def book(self, target, room, area, start_time, end_time, detected):
+        job = dict(self.room_data, room=room, area=area, date=target["date"],
+                   start_time=start_time, end_time=end_time)
+        result = self.booking_engine.run([job])[0]
+        for slot in result["slots"]:
+            if slot["status"] == mrbs.BOOKED:
+                target["held"].update(range(slot["start_time"], slot["end_time"], RESOLUTION))
+        latency_ms = (time.perf_counter() - detected) * 1000
+        # From detection to the first booking POST, the form load and the check included
+        sent = [slot["submitted_at"] for slot in result["slots"] if slot.get("submitted_at") is not None]
+        submit_ms = (min(sent) - detected) * 1000 if sent else None
+        tracing.write({"event": "watch.booked", "room": room, "date": target["date"],
+                       "start_time": start_time, "end_time": end_time,
+                       "booked": result["booked"], "detect_to_submit_ms": submit_ms,
+                       "detect_to_result_ms": latency_ms})
+        submitted = f"submitted {submit_ms:.0f} ms and " if submit_ms is not None else "nothing submitted, "
+        print(f"Freed slot in room {room} {format_seconds(start_time)}-{format_seconds(end_time)}: "
+              f"{result['booked']} booked, {submitted}done {latency_ms:.0f} ms after detection")
+
+    def run(self, until=None):
+        """Poll until every target is booked, the quota is used up or until (a timestamp) passes"""
+        while not self.done() and self.booking_engine.quota.remaining > 0:
+            if until is not None and time.time() >= until:
+                break
+            changed = False
+            for watcher in self.watchers:
+                try:
+                    change = watcher.poll()
+                except Exception as e:
+                    print(f"Could not fetch day view for area {watcher.area} on {watcher.date}: {e}")
+                    continue
+                if change is None:
+                    continue
+                changed = True
+                self.react(watcher, *change, time.perf_counter())
+
+            # Poll faster while the page is moving, back off while it is quiet
+            if changed:
+                self.interval = max(MIN_INTERVAL, self.interval / 2)
+            else:
+                self.interval = min(MAX_INTERVAL, self.interval * BACKOFF)
+            if not self.done():
+                self.booking_engine.cancelled.wait(self.interval)
+                if self.booking_engine.cancelled.is_set():
+                    break
+        return [target for target in self.targets if not self.missing(target)]
+
+
+if __name__ == "__main__":
+    import chronos
+    import config_store
+    from driver_pool import get_pool, close_pool
+    from engine import BookingEngine
+    from ledger import get_ledger
+    from planner import parse_window
+
+    parser = argparse.ArgumentParser(description="Book rooms as soon as someone cancels")
+    parser.add_argument("date", nargs="+", help="YYYY-MM-DD, one or more")
+    parser.add_argument("--room", type=int, action="append", required=True,
+                        help="Room id, repeat in order of preference")
+    parser.add_argument("--window", action="append", required=True, help="HH:MM-HH:MM, can be repeated")
+    parser.add_argument("--hours", type=float, help="Give up after this many hours")
+    args = parser.parse_args()
+
+    targets = [{"rooms": args.room, "date": date, "start_time": start_time, "end_time": end_time}
+               for date in args.date for start_time, end_time in map(parse_window, args.window)]
+    until = time.time() + args.hours * 3600 if args.hours else None
+
+    try:
+        with get_pool().lease() as driver:
+            session = http_engine.session_from_driver(driver, pool_size=1)
+            try:
+                # Freed slots go fast, skip the pre-flight and submit straight away
+                with BookingEngine.from_driver(driver, engine="http", on_result=chronos.print_slot_result,
+                                               preflight=False, ledger=get_ledger()) as booking_engine:
+                    watch = Watch(session, booking_engine, targets, config_store.load())
+                    print(f"Watching {len(watch.watchers)} day view(s), Ctrl+C to stop")
+                    try:
+                        booked = watch.run(until)
+                    except KeyboardInterrupt:
+                        booked = []
+                    print(f"{len(booked)} of {len(targets)} target(s) fully booked")
+            finally:
+                session.close()
+    finally:
+        close_pool()